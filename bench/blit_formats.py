@@ -0,0 +1,79 @@
+#!/usr/bin/env python2
+
+"""Compares the cost of blitting sprites and a zone map in the formats the game
+used before :func:`surface_format.display_format` (``convert_alpha()`` for every
+image, an unconverted map surface) against the formats it picks now, and the cost
+of converting a surface with :func:`surface_format.display_format` against the
+fixed :func:`surface_format.alpha_format` used for generated surfaces. Uses the
+dummy video driver with a 32-bit display, so no window is opened; run it from the
+repository root with ``python bench/blit_formats.py``."""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'nnlaf'))
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+
+from surface_format import alpha_format, describe, display_format
+
+
+def make_sprite(size):
+    """Returns a ``SRCALPHA`` sprite with binary alpha: an opaque disc on a transparent
+    background, like the frames of a pixel art sprite sheet."""
+    sprite = pygame.Surface((size, size), pygame.SRCALPHA, 32)
+    sprite.fill((0, 0, 0, 0))
+    pygame.draw.circle(sprite, (200, 80, 40, 255), (size // 2, size // 2), size // 2 - 2)
+    return sprite
+
+
+def make_map(size):
+    """Returns an opaque 24-bit map surface, as ``Zone`` built without a display format."""
+    surface = pygame.Surface(size, 0, 24)
+    for x in xrange(0, size[0], 32):
+        surface.fill((40 + x % 200, 60, 80), (x, 0, 16, size[1]))
+    return surface
+
+
+def time_blits(screen, surface, count, runs=5):
+    def blits():
+        for n in xrange(count):
+            screen.blit(surface, ((n * 7) % 600, (n * 13) % 440))
+
+    return min(timeit.repeat(blits, number=1, repeat=runs))
+
+
+def main():
+    pygame.display.init()
+    screen = pygame.display.set_mode((640, 480), 0, 32)
+
+    cases = [
+        ("sprite 32x32", make_sprite(32), 2000),
+        ("sprite 64x64", make_sprite(64), 1000),
+        ("zone map 640x480", make_map((640, 480)), 100),
+    ]
+
+    for name, surface, count in cases:
+        if surface.get_flags() & pygame.SRCALPHA:
+            before = surface.convert_alpha()
+        else:
+            before = surface
+        after = display_format(surface)
+
+        old = time_blits(screen, before, count)
+        new = time_blits(screen, after, count)
+
+        print "{:<18} x{:5d}: before {:8.2f} ms ({})".format(name, count, old * 1000.0, describe(before))
+        print "{:<18}        after  {:8.2f} ms ({})  x{:.1f}".format("", new * 1000.0, describe(after), old / new)
+
+    for name, surface in (("sprite 64x64", make_sprite(64)), ("text 256x16", make_sprite(256).subsurface((0, 120, 256, 16)))):
+        scanned = min(timeit.repeat(lambda: display_format(surface), number=100, repeat=5)) * 10.0
+        fixed = min(timeit.repeat(lambda: alpha_format(surface), number=100, repeat=5)) * 10.0
+        print "{:<18} convert: display_format {:6.3f} ms, alpha_format {:6.3f} ms".format(name, scanned, fixed)
+
+
+if __name__ == "__main__":
+    main()
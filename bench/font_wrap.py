@@ -0,0 +1,88 @@
+#!/usr/bin/env python2
+
+"""Compares the single-pass :func:`font.wrap_text` against the original
+character-by-character wrapping loop from ``Font.render_block``, using long
+dialogue paragraphs. Only glyph widths are needed, so no font image or display
+is loaded; run it from the repository root with ``python bench/font_wrap.py``."""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'nnlaf'))
+
+from array import array
+
+from font import CHAR_ORDER, TABLE_SIZE, wrap_text
+
+
+def old_line_width(text, char_widths):
+    total = 0
+    for c in text:
+        w = char_widths.get(c)
+        if w is not None:
+            total += w
+
+    return total
+
+
+def old_wrap(text, width, char_widths):
+    lines = []
+    line_start = 0
+    line_stop = 0
+    while line_start < len(text):
+        line_stop += 1
+
+        if line_stop >= len(text):
+            line_stop = len(text)
+            lines.append(text[line_start:line_stop])
+            line_start = line_stop
+
+        elif text[line_stop] == "\n":
+            lines.append(text[line_start:line_stop])
+            line_start = line_stop
+
+        elif old_line_width(text[line_start:line_stop], char_widths) > width:
+            line_stop -= 1
+
+            while text[line_stop - 1] != " " and line_stop != len(text):
+                original_stop = line_stop
+                line_stop -= 1
+                if line_stop <= line_start:
+                    line_stop = original_stop
+                    break
+
+            lines.append(text[line_start:line_stop])
+            line_start = line_stop
+
+    return lines
+
+
+def main():
+    char_widths = dict((c, 4 + (i % 5)) for i, c in enumerate(CHAR_ORDER))
+    widths = array("H", [0] * TABLE_SIZE)
+    for c, w in char_widths.items():
+        widths[ord(c)] = w
+
+    sentence = "Ninmu looked out over the canister apartments and wondered whether freedom was worth the cost. "
+    paragraphs = {
+        "short": sentence * 4,
+        "long": sentence * 40,
+        "very long": sentence * 200,
+    }
+
+    for width in (310, 1200):
+        for name in ("short", "long", "very long"):
+            text = paragraphs[name]
+            runs = 5
+
+            old = timeit.timeit(lambda: old_wrap(text, width, char_widths), number=runs) / runs
+            new = timeit.timeit(lambda: wrap_text(text, width, widths), number=runs) / runs
+
+            print "width {:5d}  {:>9} ({:6d} chars): old {:9.3f} ms  new {:7.3f} ms  x{:.1f}".format(
+                width, name, len(text), old * 1000.0, new * 1000.0, old / new
+            )
+
+
+if __name__ == "__main__":
+    main()
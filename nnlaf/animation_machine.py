@@ -0,0 +1,97 @@
+"""This module contains the :class:`AnimationMachine` class, a data-driven state
+machine that selects which animation a sprite should play."""
+
+import operator
+
+OPERATORS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+
+class AnimationMachine:
+    """This class compiles animation rules into integer-indexed tables, once, so that
+    choosing a sprite's animation each frame involves no string handling.
+
+    ``states`` is a sequence of state names, normally the names of animations. ``rules``
+    is a sequence of ``(sources, conditions, target)`` tuples: ``sources`` is a sequence
+    of state names the rule applies in, or ``None`` for every state; ``conditions`` is a
+    sequence of ``(variable, operator, value)`` tuples that must all hold, where
+    ``variable`` is an attribute name read from the object passed to :meth:`step`; and
+    ``target`` is the state to move to. Rules are tried in order and the first that
+    matches wins; if none match, the state does not change.
+
+    When compiled, every distinct condition gets a bit number, and every state gets a
+    list of ``(required bits, target index)`` pairs. A step evaluates each condition
+    once into a bitmask and then tests each transition with a single mask comparison."""
+    def __init__(self, states, rules):
+        self.states = tuple(states)
+        self.state_index = dict((name, n) for n, name in enumerate(self.states))
+
+        self.variables = []
+        variable_index = {}
+
+        self.conditions = []
+        condition_index = {}
+
+        self.table = [[] for state in self.states]
+
+        for sources, conditions, target in rules:
+            need = 0
+            for variable, op, value in conditions:
+                if variable not in variable_index:
+                    variable_index[variable] = len(self.variables)
+                    self.variables.append(variable)
+
+                key = (variable, op, value)
+                if key not in condition_index:
+                    condition_index[key] = len(self.conditions)
+                    self.conditions.append((variable_index[variable], OPERATORS[op], value))
+
+                need |= 1 << condition_index[key]
+
+            if sources is None:
+                source_indices = xrange(len(self.states))
+            else:
+                source_indices = [self.state_index[name] for name in sources]
+
+            for n in source_indices:
+                self.table[n].append((need, self.state_index[target]))
+
+        self.table = [tuple(transitions) for transitions in self.table]
+
+        if len(self.variables) == 1:
+            variable = self.variables[0]
+            self.read = lambda obj: (getattr(obj, variable),)
+        elif self.variables:
+            self.read = operator.attrgetter(*self.variables)
+        else:
+            self.read = lambda obj: ()
+
+    def step(self, state, obj):
+        """Returns the index of the state that follows state index ``state``, given the
+        variables of ``obj``."""
+        values = self.read(obj)
+
+        mask = 0
+        bit = 1
+        for n, op, value in self.conditions:
+            if op(values[n], value):
+                mask |= bit
+            bit <<= 1
+
+        for need, target in self.table[state]:
+            if mask & need == need:
+                return target
+
+        return state
+
+    def step_batch(self, states, objects):
+        """Steps many objects at once; ``states`` and ``objects`` are parallel sequences.
+        Returns a list of the new state indices."""
+        step = self.step
+        return [step(state, obj) for state, obj in zip(states, objects)]
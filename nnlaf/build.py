@@ -0,0 +1,206 @@
+#!/usr/bin/env python2
+
+"""This module is the offline content build. It runs every data script in a
+pool of worker processes, merges the world objects and strings they define,
+reports conflicts, and writes a single level file (see :mod:`level`) which
+:class:`Core <core.Core>` loads instead of running the scripts at startup.
+
+Run it directly: ``python build.py [--jobs N] [--output PATH] [--strict]``.
+
+Each worker runs one script against its own :class:`ScriptAPI <script_api.ScriptAPI>`
+with a :class:`BuildCore` in place of the real ``Core``; images are never decoded,
+only referred to by name. The following are reported as conflicts:
+
+*   Two scripts defining an object of the same kind with the same id.
+*   Two scripts adding a string with the same name.
+*   Two files in the data directory with the same basename, since
+    :func:`make_file_map <core.make_file_map>` silently keeps only one of them."""
+
+import os
+import sys
+import imp
+import struct
+import argparse
+
+from multiprocessing import Pool
+
+from level import export_level
+from script_api import ScriptAPI
+from world_model import KINDS, Battle, Target, Terrain
+
+CLASSES = dict(zip(KINDS, (Battle, Target, Terrain)))
+
+game_path = os.path.dirname(os.path.realpath(os.path.abspath(__file__)))
+data_path = os.path.join(game_path, 'data')
+
+
+class ImageRef:
+    """Stands in for an image surface during the build. Only the file name is kept;
+    the size is read from the PNG header if a script asks for it."""
+    def __init__(self, fn, path):
+        self.fn = fn
+        self.path = path
+
+    def get_size(self):
+        with open(self.path, "rb") as f:
+            header = f.read(24)
+        if header[:8] != "\x89PNG\r\n\x1a\n":
+            raise ValueError("Cannot read the size of {} during a build".format(self.fn))
+        return struct.unpack(">II", header[16:24])
+
+    def get_rect(self):
+        w, h = self.get_size()
+        return (0, 0, w, h)
+
+
+class BuildCore:
+    """Provides the parts of :class:`Core <core.Core>` that the ``ScriptAPI`` and scripts
+    use, without pygame: a file map, a cache, and ``get_image`` returning :class:`ImageRef`."""
+    def __init__(self, file_map):
+        self.file_map = file_map
+        self.cache = {}
+
+    def get_path(self, fn):
+        return self.file_map[fn]
+
+    def get_image(self, fn):
+        key = ("image", fn)
+
+        if key not in self.cache:
+            self.cache[key] = ImageRef(fn, self.file_map[fn])
+
+        return self.cache[key]
+
+
+def scan_data(path):
+    """Walks ``path`` and returns ``(file_map, duplicates)``; ``duplicates`` maps each
+    basename found more than once to the sorted list of its full paths."""
+    found = {}
+    for dir_path, dirs, files in os.walk(path):
+        for filename in files:
+            found.setdefault(filename, []).append(os.path.abspath(os.path.join(dir_path, filename)))
+
+    file_map = {}
+    duplicates = {}
+    for fn, paths in found.items():
+        paths.sort()
+        file_map[fn] = paths[-1]
+        if len(paths) > 1:
+            duplicates[fn] = paths
+
+    return file_map, duplicates
+
+
+def run_script(args):
+    """Worker entry point: runs the script at ``path`` and returns ``(path, records,
+    strings, error)``, where ``records`` is a list of plain tuples describing every
+    world object the script defined."""
+    path, file_map = args
+
+    api = ScriptAPI(BuildCore(file_map))
+
+    try:
+        module_name = "build_script_{}".format(abs(hash(path)))
+        script_module = imp.load_source(module_name, path)
+        script_module.main(api)
+    except Exception as e:
+        return path, [], {}, "{}: {}".format(type(e).__name__, e)
+
+    records = []
+    for kind in KINDS:
+        for obj_id, obj in api.world.by_id[kind].items():
+            images = [image.fn for image in getattr(obj, "images", ())]
+            records.append((kind, obj_id, obj.zone, tuple(obj), getattr(obj, "static", True), images))
+
+    return path, records, dict(api.strings.added), None
+
+
+def merge(results, file_map):
+    """Merges worker results into one ``ScriptAPI``. Returns ``(api, conflicts)``, where
+    ``conflicts`` is a list of messages; the first definition of a conflicting id wins."""
+    api = ScriptAPI(BuildCore(file_map))
+
+    conflicts = []
+    owners = {}
+    string_owners = {}
+
+    for path, records, strings, error in sorted(results):
+        script = os.path.basename(path)
+
+        if error is not None:
+            conflicts.append("{}: script failed: {}".format(script, error))
+            continue
+
+        for kind, obj_id, zone, rect, static, images in records:
+            owner = owners.get((kind, obj_id))
+            if owner is not None:
+                conflicts.append("{}: {} id {!r} already defined by {}".format(script, kind, obj_id, owner))
+                continue
+            owners[(kind, obj_id)] = script
+
+            obj = CLASSES[kind]()
+            obj.x, obj.y, obj.w, obj.h = rect
+            obj.zone = zone
+            if kind == "terrain":
+                obj.static = static
+                obj.images = [api._core.get_image(fn) for fn in images]
+            api.world.add(obj_id, obj)
+
+        for name, string in strings.items():
+            owner = string_owners.get(name)
+            if owner is not None:
+                conflicts.append("{}: string {!r} already added by {}".format(script, name, owner))
+                continue
+            string_owners[name] = script
+            api.add_string(name, string)
+
+    return api, conflicts
+
+
+def build(data_dir, output, jobs=None):
+    """Builds the level file ``output`` from the scripts in ``data_dir`` using ``jobs``
+    worker processes (one per CPU by default). Returns the list of conflicts found."""
+    file_map, duplicates = scan_data(data_dir)
+
+    conflicts = []
+    for fn in sorted(duplicates):
+        conflicts.append("duplicate basename {!r}: {}".format(fn, ", ".join(duplicates[fn])))
+
+    scripts = sorted(path for path in file_map.values() if path.endswith(".py"))
+
+    pool = Pool(jobs)
+    try:
+        results = pool.map(run_script, [(path, file_map) for path in scripts])
+    finally:
+        pool.close()
+        pool.join()
+
+    api, merge_conflicts = merge(results, file_map)
+    conflicts.extend(merge_conflicts)
+
+    export_level(api, output)
+
+    return conflicts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the prebuilt world level file from the data scripts.")
+    parser.add_argument("--jobs", type=int, default=None, help="number of worker processes (default: one per CPU)")
+    parser.add_argument("--output", default=None, help="level file to write (default: world.level in the data directory)")
+    parser.add_argument("--strict", action="store_true", help="exit with an error if any conflicts are found")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    from core import LEVEL_FILE
+    output = args.output or os.path.join(data_path, LEVEL_FILE)
+
+    conflicts = build(data_path, output, args.jobs)
+
+    for conflict in conflicts:
+        print "BUILD: {}".format(conflict)
+    print "BUILD: wrote {} ({} conflicts)".format(output, len(conflicts))
+
+    if conflicts and args.strict:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
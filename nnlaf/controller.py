@@ -1,5 +1,22 @@
 import pygame
 
+from array import array
+
+from input_log import InputRecorder, InputPlayer
+from startup import ensure_joystick
+
+BUTTONS = ("A", "B", "X", "Y", "U", "D", "L", "R", "LB", "RB", "BACK", "START")
+
+BUTTON_BITS = dict((button, 1 << n) for n, button in enumerate(BUTTONS))
+
+EVENT_CODES = {
+    pygame.KEYDOWN: "key",
+    pygame.KEYUP: "key",
+    pygame.JOYBUTTONDOWN: "button",
+    pygame.JOYBUTTONUP: "button",
+    pygame.JOYHATMOTION: "value",
+}
+
 
 class Controller:
     """This class encapsulates the state of a virtual controller, providing
@@ -7,32 +24,25 @@ class Controller:
     controller is based on keyboard and/or joystick input, but hides these
     details so that game logic does not need to understand different devices
     or mappings."""
-    def __init__(self):
+    def __init__(self, history_size=64):
         """Creates a new Controller instance with default bindings. Only one
         instance should be active at a time. Future versions will allow for
-        re-mapping controls and may also allow multiple controller instances."""
-        if pygame.joystick.get_count() > 0:
-            pygame.joystick.Joystick(0).init()
+        re-mapping controls and may also allow multiple controller instances.
 
-        self.state = {
-            "A": False,
-            "B": False,
-            "X": False,
-            "Y": False,
+        The state of each frame is a bitmask; bit ``n`` is set while ``BUTTONS[n]``
+        is pressed. The masks of the last ``history_size`` frames are kept in a
+        ring buffer for queries such as :meth:`pressed_within`.
 
-            "U": False,
-            "D": False,
-            "L": False,
-            "R": False,
+        Every method that takes a ``button`` accepts either its name or its bit
+        from ``BUTTON_BITS``; passing the bit skips a dictionary lookup.
 
-            "LB": False,
-            "RB": False,
+        The joystick subsystem is started by the first :meth:`update` that reads input,
+        so a replay never starts it."""
+        self.state = 0
+        self.prev = 0
 
-            "BACK": False,
-            "START": False,
-        }
-
-        self.prev = self.state.copy()
+        self.history = array("H", [0] * history_size)
+        self.frame = 0
 
         self.bindings = [
             {
@@ -70,54 +80,201 @@ class Controller:
             },
         ]
 
+        self.pump = None
+        self.compile_bindings()
+
+        self.recorder = None
+        self.record_pending = False
+        self.player = None
+
+        self.latency = None
+
+    def attach(self, pump):
+        """Subscribes this controller to ``pump``, an :class:`EventPump <events.EventPump>`.
+        Once attached, the controller no longer reads pygame's event queue itself;
+        it receives input events from the pump instead."""
+        self.pump = pump
+        pump.subscribe(self.handle_event, *EVENT_CODES.keys())
+
+    def compile_bindings(self):
+        """Builds the dispatch table from ``self.bindings``. The table maps each
+        ``(event type, code)`` pair directly to a list of ``(bit, state)`` pairs,
+        so handling an event costs one lookup regardless of how many bindings exist.
+        Call this after replacing ``self.bindings`` wholesale; :meth:`bind` and
+        :meth:`unbind` update the table incrementally."""
+        self.dispatch = {}
+
+        for bind_set in self.bindings:
+            for source, button in bind_set.items():
+                self._add_entries(source, button)
+
+    def bind(self, source, button, bind_set=0):
+        """Binds ``source`` to ``button`` in ``self.bindings[bind_set]``, replacing any
+        previous binding of ``source`` in that set. ``source`` is a pygame key constant,
+        ``("JB", n)`` for joystick button ``n``, or ``("JHX", n)``/``("JHY", n)`` for
+        hat direction ``n``. Only the dispatch entries for ``source`` are changed."""
+        self.unbind(source, bind_set)
+        self.bindings[bind_set][source] = button
+        self._add_entries(source, button)
+
+    def unbind(self, source, bind_set=0):
+        """Removes the binding of ``source`` from ``self.bindings[bind_set]``, if any."""
+        button = self.bindings[bind_set].pop(source, None)
+        if button is None:
+            return
+
+        for key, action in self._entries(source, button):
+            actions = self.dispatch.get(key)
+            if actions is not None and action in actions:
+                actions.remove(action)
+                if not actions:
+                    del self.dispatch[key]
+
+    def _add_entries(self, source, button):
+        for key, action in self._entries(source, button):
+            self.dispatch.setdefault(key, []).append(action)
+
+    @staticmethod
+    def _entries(source, button):
+        """Yields the ``((event type, code), (bit, state))`` dispatch entries for a binding."""
+        button = BUTTON_BITS[button]
+        if isinstance(source, tuple):
+            kind, n = source
+            if kind == "JB":
+                yield (pygame.JOYBUTTONDOWN, n), (button, True)
+                yield (pygame.JOYBUTTONUP, n), (button, False)
+            elif kind in ("JHX", "JHY"):
+                axis = 0 if kind == "JHX" else 1
+                for jhx in (-1, 0, 1):
+                    for jhy in (-1, 0, 1):
+                        value = (jhx, jhy)
+                        yield (pygame.JOYHATMOTION, value), (button, value[axis] == n)
+        else:
+            yield (pygame.KEYDOWN, source), (button, True)
+            yield (pygame.KEYUP, source), (button, False)
+
+    def handle_event(self, event):
+        """Applies a single input event to the controller state. Events are ignored
+        while a replay is running."""
+        if self.player is not None:
+            return
+
+        actions = self.dispatch.get((event.type, getattr(event, EVENT_CODES[event.type])))
+        if actions is not None:
+            for bit, down in actions:
+                if self.latency is not None and bool(self.state & bit) != down:
+                    self.latency.received(bit)
+
+                if down:
+                    self.state |= bit
+                else:
+                    self.state &= ~bit
+
     def update(self):
-        """Call this once per frame; it reads input from pygame's event system
-        and translates that data into virtual controller state."""
-        self.prev.update(self.state)
-
-        for event in pygame.event.get():
-            for bind_set in self.bindings:
-                if event.type == pygame.KEYDOWN:
-                    button = bind_set.get(event.key)
-                    if button is not None:
-                        self.state[button] = True
-                elif event.type == pygame.KEYUP:
-                    button = bind_set.get(event.key)
-                    if button is not None:
-                        self.state[button] = False
-                elif event.type == pygame.JOYBUTTONDOWN:
-                    key = ("JB", event.button)
-                    button = bind_set.get(key)
-                    if button is not None:
-                        self.state[button] = True
-                elif event.type == pygame.JOYBUTTONUP:
-                    key = ("JB", event.button)
-                    button = bind_set.get(key)
-                    if button is not None:
-                        self.state[button] = False
-                elif event.type == pygame.JOYHATMOTION:
-                    jhx, jhy = event.value
-                    for axis, val in (("JHX", jhx), ("JHY", jhy)):
-                        for n in (-1, 1):
-                            button = bind_set.get((axis, n))
-                            if button is not None:
-                                if n == val:
-                                    self.state[button] = True
-                                else:
-                                    self.state[button] = False
+        """Call this once per frame, before input events are delivered; it records the
+        previous frame's state for :meth:`just_pressed` and :meth:`just_released`.
+        If the controller is not attached to an :class:`EventPump <events.EventPump>`,
+        it also reads input from pygame's event system itself.
+
+        While recording, the state the previous frame ended with is written to the
+        log. While replaying, the state comes from the log instead of from input events."""
+        if self.recorder is not None:
+            if self.record_pending:
+                self.recorder.record(self.state)
+            self.record_pending = True
+
+        self.history[self.frame % len(self.history)] = self.state
+        self.frame += 1
+        self.prev = self.state
+
+        if self.player is not None:
+            self.state = self.player.next()
+            return
+
+        ensure_joystick()
+        if self.pump is None:
+            for event in pygame.event.get(EVENT_CODES.keys()):
+                self.handle_event(event)
+            if self.latency is not None:
+                self.latency.drained()
+
+    def start_recording(self, path):
+        """Starts writing the state of every frame to an input log at ``path``;
+        see :class:`InputRecorder <input_log.InputRecorder>`."""
+        self.stop()
+        self.recorder = InputRecorder(path, len(BUTTONS))
+        self.record_pending = False
+
+    def start_replay(self, path):
+        """Starts feeding the frames of the input log at ``path`` into the controller
+        in place of live input; see :class:`InputPlayer <input_log.InputPlayer>`."""
+        self.stop()
+        self.player = InputPlayer(path, len(BUTTONS))
+
+    @property
+    def replay_done(self):
+        """``True`` if a replay was started and all of its frames have been used."""
+        return self.player is not None and self.player.done
+
+    def stop(self):
+        """Stops any recording or replay in progress. A recording includes the current frame."""
+        if self.recorder is not None:
+            if self.record_pending:
+                self.recorder.record(self.state)
+            self.recorder.close()
+            self.recorder = None
+            self.record_pending = False
+
+        self.player = None
 
     def pressed(self, button):
         """Returns ``True`` if ``button`` is currently pressed."""
-        return self.state[button]
+        return bool(self.state & BUTTON_BITS.get(button, button))
 
     def just_pressed(self, button):
         """Returns ``True`` if ``button`` is currently pressed, but was not pressed last frame."""
-        return self.state[button] and not self.prev[button]
+        return bool((self.state ^ self.prev) & self.state & BUTTON_BITS.get(button, button))
 
     def released(self, button):
         """Returns ``True`` if ``button`` is currently released (not being pressed)."""
-        return not self.state[button]
+        return not self.state & BUTTON_BITS.get(button, button)
 
     def just_released(self, button):
         """Returns ``True`` if ``button`` is currently released, but was not released last frame."""
-        return self.prev[button] and not self.state[button]
+        return bool((self.state ^ self.prev) & self.prev & BUTTON_BITS.get(button, button))
+
+    def mask_at(self, age):
+        """Returns the state mask from ``age`` frames ago; ``0`` is the current frame. Frames
+        from before the controller was created, or older than the history, read as ``0``."""
+        if age == 0:
+            return self.state
+        if age > self.frame or age > len(self.history):
+            return 0
+        return self.history[(self.frame - age) % len(self.history)]
+
+    def pressed_within(self, button, frames):
+        """Returns ``True`` if ``button`` was pressed in any of the last ``frames`` frames,
+        including the current one."""
+        bit = BUTTON_BITS.get(button, button)
+        for age in xrange(frames):
+            if self.mask_at(age) & bit:
+                return True
+        return False
+
+    def just_pressed_age(self, button, frames):
+        """Returns how many frames ago ``button`` was last just pressed, searching the last
+        ``frames`` frames, or ``-1`` if it was not. ``0`` means this frame. This is the basis
+        for input buffering ("was jump pressed within the last 6 frames") and for combos,
+        by comparing the ages of several buttons."""
+        bit = BUTTON_BITS.get(button, button)
+        newer = self.state & bit
+        for age in xrange(frames):
+            older = self.mask_at(age + 1) & bit
+            if newer and not older:
+                return age
+            newer = older
+        return -1
+
+    def just_pressed_within(self, button, frames):
+        """Returns ``True`` if ``button`` was just pressed in any of the last ``frames`` frames."""
+        return self.just_pressed_age(button, frames) >= 0
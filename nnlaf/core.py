@@ -2,9 +2,16 @@
 
 import os
 import imp
+import threading
 import pygame
 
+from timeit import default_timer
+
 from script_api import ScriptAPI
+from startup import timeline, ensure_mixer
+from surface_format import display_format
+
+LEVEL_FILE = "world.level"
 
 
 def make_file_map(path):
@@ -24,44 +31,184 @@ def make_file_map(path):
     return file_map
 
 
+class FileMapScan:
+    """This class runs :func:`make_file_map` on ``path`` in a background thread, so
+    that walking the data directory overlaps with the rest of startup. The times the
+    walk started and finished are kept in ``started`` and ``finished``."""
+    def __init__(self, path):
+        self.path = path
+        self.file_map = None
+
+        self.started = default_timer()
+        self.finished = None
+
+        self.thread = threading.Thread(target=self._scan)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _scan(self):
+        self.file_map = make_file_map(self.path)
+        self.finished = default_timer()
+
+    @property
+    def done(self):
+        return not self.thread.is_alive()
+
+    def result(self):
+        """Waits for the walk to finish and returns the file map."""
+        self.thread.join()
+        return self.file_map
+
+
+class FileWatcher:
+    """This class detects changes to the files in a file map by polling their
+    modification times, for reloading assets while the game is running. Each
+    call to :meth:`poll` stats the known files; every ``rescan_every`` polls the
+    directory is also walked again to find files that were added or removed.
+
+    The file map passed in is updated in place as files come and go."""
+    def __init__(self, path, file_map, rescan_every=10):
+        self.path = path
+        self.file_map = file_map
+        self.rescan_every = rescan_every
+
+        self.polls = 0
+        self.mtimes = {}
+        for fn, full_path in file_map.items():
+            self.mtimes[fn] = self._mtime(full_path)
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return None
+
+    def poll(self):
+        """Returns a sorted list of the basenames of files that changed, appeared or
+        disappeared since the last poll."""
+        changed = set()
+
+        self.polls += 1
+        if self.polls % self.rescan_every == 0:
+            current = make_file_map(self.path)
+            for fn in set(current) ^ set(self.file_map):
+                changed.add(fn)
+            self.file_map.clear()
+            self.file_map.update(current)
+
+        for fn, full_path in self.file_map.items():
+            mtime = self._mtime(full_path)
+            if mtime != self.mtimes.get(fn):
+                changed.add(fn)
+                self.mtimes[fn] = mtime
+
+        for fn in changed:
+            if fn not in self.file_map:
+                self.mtimes.pop(fn, None)
+
+        return sorted(changed)
+
+
 class Core:
     """This class handles logistical tasks like locating and loading game assets.
     All of the methods below use a file map generated by :func:`make_file_map`
     to locate files, therefore ``fn`` should be a basename only with
-    no path information."""
-    def __init__(self, data_dir, save_dir):
+    no path information.
+
+    If the data directory contains a prebuilt level file named ``LEVEL_FILE``
+    and ``use_level`` is ``True``, the data scripts are not run; world objects
+    and strings are read from the level file instead (see :mod:`level`).
+
+    The data directory is walked by a :class:`FileMapScan` in the background, so
+    ``file_map`` stays empty until :meth:`finish_scan` is called; the first
+    :meth:`update` does so. ``file_map`` is filled in place, so references to it
+    taken earlier remain valid.
+
+    If ``pack_path`` is given, assets are read from that :class:`PackFile
+    <pack.PackFile>` instead and the data directory is not walked at all; ``file_map``
+    stays empty and :meth:`get_path` is unavailable, so the pack must contain the
+    level file. Loose files remain the default, for development."""
+    def __init__(self, data_dir, save_dir, use_level=True, pack_path=None):
         self.running = True
         self.ready = False
 
-        self.file_map = make_file_map(data_dir)
+        self.data_dir = data_dir
+        self.save_dir = save_dir
+        self.use_level = use_level
+
+        self.pack = None
+        self.scan = None
+        if pack_path is not None:
+            from pack import PackFile
+            self.pack = PackFile(pack_path)
+        else:
+            self.scan = FileMapScan(data_dir)
+
+        self.scanned = False
+        self.file_map = {}
         self.cache = {}
-        
-        self.pending_script_files = [val for val in self.file_map.values() if val.endswith(".py")]
-        self.pending_script_files.sort()
+        self.image_names = {}
+
+        self.pending_script_files = []
         self.script_api = ScriptAPI(self)
+        self.script_api.strings.pack = self.pack
 
         self.screen = pygame.display.get_surface()
 
         self.current_music = None
+        self.music = None
+
+    def finish_scan(self):
+        """Waits for the background walk of the data directory, fills ``file_map`` and
+        queues the data scripts, or attaches the level file instead. Does nothing if
+        it has already been done."""
+        if self.scanned:
+            return
+        self.scanned = True
+
+        if self.scan is not None:
+            self.file_map.update(self.scan.result())
+            timeline.add("file map (background)", self.scan.started, self.scan.finished)
+            self.scan = None
+
+        strings = self.script_api.strings
+        strings.set_locale(strings.locale)
+
+        if self.use_level and self.has_file(LEVEL_FILE):
+            from level import LevelFile
+            if self.pack is not None:
+                level = LevelFile(LEVEL_FILE, self.pack.buffer(LEVEL_FILE))
+            else:
+                level = LevelFile(self.file_map[LEVEL_FILE])
+            self.script_api.attach_level(level)
+        elif self.pack is not None:
+            print "CORE: Pack {} has no {}; there is nothing to load".format(self.pack.path, LEVEL_FILE)
+        else:
+            self.pending_script_files = sorted(val for val in self.file_map.values() if val.endswith(".py"))
 
-    def fast_step(self):
+        if self.screen is None:
+            self.screen = pygame.display.get_surface()
+
+    def update(self):
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 print("CORE says: Canceled load because user closed window.")
                 self.running = False
 
+        self.finish_scan()
+
         if self.ready:
             self.running = False
-
-    def step(self):
-        self.fast_step()
-
-        if len(self.pending_script_files) > 0:
+        elif len(self.pending_script_files) > 0:
             curr_script = self.pending_script_files.pop(0)
             self.load_script(curr_script)
         else:
             self.ready = True
 
+    def draw(self, alpha):
+        pass
+
     def load_script(self, path):
         try:
             script_module = imp.load_source("script_module", path)
@@ -73,18 +220,64 @@ class Core:
         except TypeError:
             print "CORE: Script Loader: main() TypeError {}".format(path)
 
+    def invalidate(self, fn):
+        """Removes every cache entry derived from the file named ``fn`` (images, flipped
+        images, tiles, sounds and fonts), so it is loaded again the next time it is asked
+        for. Returns the removed entries as a list of ``(key, value)`` pairs."""
+        removed = []
+        for key in self.cache.keys():
+            if key[1] == fn:
+                removed.append((key, self.cache.pop(key)))
+                if key[0] == "image":
+                    self.image_names.pop(removed[-1][1], None)
+
+        if self.current_music == fn:
+            self.current_music = None
+
+        return removed
+
     ### Resource loading methods
 
+    def has_file(self, fn):
+        """Returns ``True`` if there is a file named ``fn``, in the pack or on disk."""
+        if self.pack is not None:
+            return fn in self.pack
+        return fn in self.file_map
+
     def get_path(self, fn):
-        """Returns the absolute path to the file named ``fn``."""
+        """Returns the absolute path to the file named ``fn``. Loose files only; raises
+        ``KeyError`` when reading from a pack."""
         return self.file_map[fn]
 
+    def read_file(self, fn):
+        """Returns the contents of the file named ``fn`` as a string."""
+        if self.pack is not None:
+            return self.pack.read(fn)
+
+        with open(self.file_map[fn], "rb") as f:
+            return f.read()
+
+    def open_file(self, fn):
+        """Returns a file object reading the file named ``fn``. From a pack, the contents
+        are copied straight out of the mapped archive."""
+        if self.pack is not None:
+            return self.pack.open(fn)
+
+        return open(self.file_map[fn], "rb")
+
     def get_image(self, fn):
-        """Returns a ``pygame.Surface`` loaded from the file named ``fn``."""
+        """Returns a ``pygame.Surface`` loaded from the file named ``fn``, in the format
+        chosen by :func:`display_format <surface_format.display_format>`. ``image_names``
+        maps the surface back to ``fn``, so that saves can refer to it by name."""
         key = ("image", fn)
 
         if key not in self.cache:
-            self.cache[key] = pygame.image.load(self.file_map[fn]).convert_alpha()
+            if self.pack is not None:
+                image = pygame.image.load(self.pack.open(fn), fn)
+            else:
+                image = pygame.image.load(self.file_map[fn])
+            self.cache[key] = display_format(image)
+            self.image_names[self.cache[key]] = fn
 
         return self.cache[key]
 
@@ -93,22 +286,57 @@ class Core:
         key = ("sound", fn)
 
         if key not in self.cache:
-            self.cache[key] = pygame.mixer.Sound(self.file_map[fn])
+            ensure_mixer()
+            if self.pack is not None:
+                self.cache[key] = pygame.mixer.Sound(self.pack.open(fn))
+            else:
+                self.cache[key] = pygame.mixer.Sound(self.file_map[fn])
             self.cache[key].set_volume(0.5)
 
         return self.cache[key]
 
     def get_font(self, fn):
-        """Returns a ``font.Font`` loaded from the file named ``fn``."""
-        from font import Font
+        """Returns a ``font.Font`` loaded from the file named ``fn``. Glyph metrics are
+        stored in a ``.metrics`` file next to the image the first time the font is
+        loaded, and re-used for as long as they are newer than the image. From a pack,
+        the ``.metrics`` file is used if it was packed, and never written."""
+        from font import Font, parse_metrics
 
         key = ("font", fn)
 
         if key not in self.cache:
-            self.cache[key] = Font(self.get_image(fn))
+            image = self.get_image(fn)
+
+            if self.pack is not None:
+                metrics = None
+                if fn + ".metrics" in self.pack:
+                    metrics = parse_metrics(self.pack.read(fn + ".metrics"))
+            else:
+                metrics = self._local_metrics(fn, image)
+
+            self.cache[key] = Font(image, metrics)
 
         return self.cache[key]
 
+    def _local_metrics(self, fn, image):
+        from font import scan_glyphs, load_metrics, save_metrics
+
+        image_path = self.file_map[fn]
+        metrics_path = image_path + ".metrics"
+
+        metrics = None
+        if os.path.exists(metrics_path) and os.path.getmtime(metrics_path) >= os.path.getmtime(image_path):
+            metrics = load_metrics(metrics_path)
+
+        if metrics is None:
+            metrics = scan_glyphs(image)
+            try:
+                save_metrics(metrics_path, metrics)
+            except (IOError, OSError):
+                print "CORE: Font Loader: Could not write metrics for {}".format(fn)
+
+        return metrics
+
     def get_image_flipped(self, fn, h=True, v=False):
         """Returns a flipped version of the ``pygame.Surface`` returned by ``self.get_image(fn)``."""
         key = ("image_flipped", fn, h, v)
@@ -141,15 +369,78 @@ class Core:
 
         return self.cache[key]
 
+    def preload_music(self, fn):
+        """Starts loading the music file named ``fn`` in the background, so that a later
+        :meth:`play_music` can switch to it without delay. Does nothing unless a
+        :class:`MusicPlayer <sound.MusicPlayer>` is attached as ``self.music``."""
+        if self.music is not None:
+            self.music.preload(fn)
+
+    def get_tiles_flipped(self, fn, cols, rows, h=True, v=False):
+        """Returns the tiles of ``self.get_image_flipped(fn, h, v)`` in the same order as
+        ``self.get_tiles(fn, cols, rows)``, so that each tile is the flipped version of the
+        tile at the same index. The sheet is flipped once, as a whole."""
+        key = ("tiles_flipped", fn, cols, rows, h, v)
+
+        if key not in self.cache:
+            surface = self.get_image_flipped(fn, h, v)
+
+            tw = surface.get_width() // cols
+            th = surface.get_height() // rows
+
+            tiles = []
+
+            for row in xrange(rows):
+                for col in xrange(cols):
+                    # Measured from the far edge, since the flip moves any leftover
+                    # pixels of a sheet not divisible into whole tiles to the near one.
+                    x = surface.get_width() - (col + 1) * tw if h else col * tw
+                    y = surface.get_height() - (row + 1) * th if v else row * th
+                    tiles.append(surface.subsurface((x, y, tw, th)))
+
+            self.cache[key] = tiles
+
+        return self.cache[key]
+
+    def get_sheet(self, fn, cols, rows, mirrored=False):
+        """Returns a :class:`SpriteSheet <sprite_sheet.SpriteSheet>` of the tiles from
+        ``self.get_tiles(fn, cols, rows)``, followed by their horizontally flipped versions if
+        ``mirrored`` is ``True``. The sheet and its animations are shared by every caller."""
+        from sprite_sheet import SpriteSheet
+
+        key = ("sheet", fn, cols, rows, mirrored)
+
+        if key not in self.cache:
+            frames = list(self.get_tiles(fn, cols, rows))
+            if mirrored:
+                frames.extend(self.get_tiles_flipped(fn, cols, rows))
+
+            self.cache[key] = SpriteSheet(frames)
+
+        return self.cache[key]
+
     def play_music(self, fn):
-        """Starts playing the music file named ``fn`` if it is not already playing."""
-        if self.current_music != fn:
-            pygame.mixer.music.load(self.file_map[fn])
+        """Starts playing the music file named ``fn`` if it is not already playing. If a
+        :class:`MusicPlayer <sound.MusicPlayer>` is attached as ``self.music``, the switch
+        is a crossfade that does not block; otherwise the file is loaded immediately, and
+        streamed from its path, or from a copy in memory when it comes from a pack."""
+        if self.music is not None:
+            self.music.play(fn)
+            self.current_music = fn
+        elif self.current_music != fn:
+            ensure_mixer()
+            if self.pack is not None:
+                pygame.mixer.music.load(self.pack.open(fn))
+            else:
+                pygame.mixer.music.load(self.file_map[fn])
             pygame.mixer.music.set_volume(0.5)
             pygame.mixer.music.play(-1)
             self.current_music = fn
 
     def stop_music(self):
         """Stops whatever music is currently playing. Safe to call when no music is playing."""
-        pygame.mixer.music.stop()
+        if self.music is not None:
+            self.music.stop()
+        elif pygame.mixer.get_init():
+            pygame.mixer.music.stop()
         self.current_music = None
@@ -0,0 +1,111 @@
+"""This module contains the :class:`Dialogue` class, a typewriter-style text box."""
+
+import pygame
+
+
+class Dialogue:
+    """This class displays a block of text in a box at the bottom of the screen,
+    revealing it a few characters at a time like a typewriter. Text that does
+    not fit in the box is split into pages; the player presses ``A`` to reveal
+    the rest of the current page at once, or to move on to the next page once
+    it is fully shown. After the last page, the dialogue closes itself by
+    clearing ``game.dialogue``.
+
+    The whole text is laid out once when the ``Dialogue`` is created. Each
+    frame only the newly revealed glyphs are blitted onto a persistent surface,
+    so the cost of a frame does not depend on how much text is already shown."""
+    def __init__(self, game, text, rate=1.0, font_fn="font_8bit_operator_white.png"):
+        self.game = game
+        self.core = self.game.core
+        self.screen = self.game.screen
+
+        self.font = self.core.get_font(font_fn)
+        self.text = text
+        self.rate = rate
+
+        screen_w, screen_h = self.screen.get_size()
+
+        self.padding = 5
+        self.w = screen_w - 32
+        self.h = (self.font.height * 4) + (self.padding * 2)
+        self.x = 16
+        self.y = screen_h - (self.h + 16)
+
+        self.bg_color = (32, 32, 32)
+
+        lines = self.font.layout(self.text, self.w - (self.padding * 2))
+        lines_per_page = max(1, (self.h - (self.padding * 2)) // self.font.height)
+
+        self.pages = []
+        for i in xrange(0, max(len(lines), 1), lines_per_page):
+            self.pages.append(self.font.place(self.text, lines[i:i + lines_per_page]))
+
+        self.surface = pygame.Surface((self.w, self.h))
+        if pygame.display.get_surface() is not None:
+            self.surface = self.surface.convert()
+
+        self.page = 0
+        self.shown = 0
+        self.progress = 0.0
+
+        self.open_page(0)
+
+    @property
+    def page_done(self):
+        """``True`` if every glyph of the current page has been revealed."""
+        return self.shown >= len(self.pages[self.page])
+
+    @property
+    def last_page(self):
+        """``True`` if the current page is the final page of the text."""
+        return self.page >= len(self.pages) - 1
+
+    def open_page(self, page):
+        """Clears the box and starts revealing ``page`` from the beginning."""
+        self.page = page
+        self.shown = 0
+        self.progress = 0.0
+        self.surface.fill(self.bg_color)
+
+    def reveal(self, count):
+        """Blits glyphs of the current page until ``count`` of them are shown; only
+        glyphs that were not already shown are drawn."""
+        glyphs = self.pages[self.page]
+        count = min(count, len(glyphs))
+
+        font = self.font
+        surface = self.surface
+        x0 = self.padding
+        y0 = self.padding
+        for code, x, y in glyphs[self.shown:count]:
+            font.render_glyph(code, surface, (x0 + x, y0 + y))
+
+        self.shown = max(self.shown, count)
+
+    def skip(self):
+        """Reveals the remainder of the current page immediately."""
+        self.reveal(len(self.pages[self.page]))
+        self.progress = float(self.shown)
+
+    def advance(self):
+        """Moves to the next page, or closes the dialogue after the last page."""
+        if self.last_page:
+            if self.game.dialogue is self:
+                self.game.dialogue = None
+        else:
+            self.open_page(self.page + 1)
+
+    def update(self):
+        if self.game.controller.just_pressed("A"):
+            if self.page_done:
+                self.advance()
+            else:
+                self.skip()
+            return
+
+        if not self.page_done:
+            self.progress += self.rate
+            self.reveal(int(self.progress))
+
+    def draw(self):
+        self.screen.blit(self.surface, (self.x, self.y))
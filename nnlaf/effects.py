@@ -0,0 +1,89 @@
+"""This module contains the :class:`EffectCache` class, which makes and keeps the
+recolored versions of sprite frames used for flashes, tints and outlines."""
+
+import pygame
+
+from surface_cache import SurfaceCache
+from surface_format import alpha_format
+
+WHITE = (255, 255, 255)
+
+NEIGHBOURS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+
+
+def make_silhouette(frame, color=WHITE):
+    """Returns a copy of ``frame`` with every pixel set to ``color``, keeping the
+    alpha of the original."""
+    surface = pygame.Surface(frame.get_size(), pygame.SRCALPHA, 32)
+    surface.blit(frame, (0, 0))
+    surface.fill(WHITE + (0,), special_flags=pygame.BLEND_RGBA_MAX)
+    if color != WHITE:
+        surface.fill(tuple(color) + (255,), special_flags=pygame.BLEND_RGBA_MULT)
+
+    return surface
+
+
+def make_tint(frame, color):
+    """Returns a copy of ``frame`` with its colors multiplied by ``color``."""
+    surface = pygame.Surface(frame.get_size(), pygame.SRCALPHA, 32)
+    surface.blit(frame, (0, 0))
+    surface.fill(color, special_flags=pygame.BLEND_RGB_MULT)
+
+    return surface
+
+
+def make_outline(frame, color):
+    """Returns a copy of ``frame`` with a one pixel outline of ``color`` around its
+    opaque pixels. The result is the same size as ``frame``, so the outline is
+    clipped where the frame touches its edges."""
+    silhouette = make_silhouette(frame, color)
+
+    surface = pygame.Surface(frame.get_size(), pygame.SRCALPHA, 32)
+    for dx, dy in NEIGHBOURS:
+        surface.blit(silhouette, (dx, dy))
+    surface.blit(frame, (0, 0))
+
+    return surface
+
+
+EFFECTS = {
+    "flash": make_silhouette,
+    "silhouette": make_silhouette,
+    "tint": make_tint,
+    "outline": make_outline,
+}
+
+
+class EffectCache:
+    """This class makes versions of sprite frames with an effect applied, the first
+    time each one is asked for, and keeps them in a :class:`SurfaceCache
+    <surface_cache.SurfaceCache>` limited to ``max_bytes``. Drawing a frame with an
+    effect then costs the same single blit as drawing it without one.
+
+    An effect is a tuple of a name from :data:`EFFECTS` and its arguments, for
+    example ``("flash",)``, ``("tint", (255, 128, 128))``, ``("silhouette", (0, 0, 0))``
+    or ``("outline", (255, 255, 0))``. Variants are converted by :func:`alpha_format
+    <surface_format.alpha_format>`, without reading their pixels again."""
+    def __init__(self, max_bytes=2 * 1024 * 1024):
+        self.variants = SurfaceCache(max_bytes)
+
+    def get(self, frame, effect):
+        """Returns ``frame`` with ``effect`` applied. The result is shared and must
+        not be modified."""
+        key = (frame, effect)
+
+        surface = self.variants.get(key)
+        if surface is None:
+            surface = alpha_format(EFFECTS[effect[0]](frame, *effect[1:]))
+            self.variants.put(key, surface)
+
+        return surface
+
+    def clear(self):
+        """Removes every stored variant."""
+        self.variants.clear()
+
+    def stats(self):
+        """Returns the statistics of the underlying :class:`SurfaceCache
+        <surface_cache.SurfaceCache>`."""
+        return self.variants.stats()
@@ -0,0 +1,46 @@
+"""This module contains the :class:`EventPump` class, which owns pygame's event queue."""
+
+import pygame
+
+
+class EventPump:
+    """This class drains pygame's event queue exactly once per frame and passes
+    each event to the subscribers registered for its type. Components such as
+    the :class:`Controller <controller.Controller>` or debug overlays subscribe
+    to the event types they care about instead of reading the queue
+    themselves, so no component can swallow events meant for another."""
+    def __init__(self):
+        self.handlers = {}
+        self.catch_all = []
+
+    def subscribe(self, callback, *event_types):
+        """Calls ``callback(event)`` for every event whose type is in ``event_types``.
+        If no event types are given, ``callback`` receives every event."""
+        if not event_types:
+            self.catch_all.append(callback)
+
+        for event_type in event_types:
+            self.handlers.setdefault(event_type, []).append(callback)
+
+    def unsubscribe(self, callback):
+        """Removes ``callback`` from every event type it was subscribed to."""
+        if callback in self.catch_all:
+            self.catch_all.remove(callback)
+
+        for event_type, callbacks in self.handlers.items():
+            if callback in callbacks:
+                callbacks.remove(callback)
+            if not callbacks:
+                del self.handlers[event_type]
+
+    def pump(self):
+        """Drains the event queue, dispatching every event to its subscribers.
+        Call this once per frame."""
+        handlers = self.handlers
+        catch_all = self.catch_all
+
+        for event in pygame.event.get():
+            for callback in handlers.get(event.type, ()):
+                callback(event)
+            for callback in catch_all:
+                callback(event)
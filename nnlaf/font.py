@@ -1,7 +1,166 @@
+import sys
+import struct
 import pygame
 
+from array import array
+
+from surface_cache import SurfaceCache
+from surface_format import blank_like
+
 CHAR_ORDER = """ !"#$%&'()*+,-./0123456789:;<=>?@ABCDEFGHIJKLMNOPQRSTUVWXYZ[\]^_`abcdefghijklmnopqrstuvwxyz{|}~"""
 
+TABLE_SIZE = 128
+
+METRICS_MAGIC = "NNFM"
+METRICS_VERSION = 1
+METRICS_HEADER = struct.Struct("<4sHHH")
+
+
+def scan_glyphs(surface):
+    """Finds the glyph boundaries in a font ``surface`` and returns its metrics as a pair
+    of ``array`` tables, ``(offsets, widths)``, each indexed by character code. Characters
+    without a glyph have a width of zero.
+
+    The top row is converted to a single RGBA string and searched for the delimiter color
+    with ``str.find``, rather than reading it one pixel at a time with ``get_at``."""
+    width = surface.get_width()
+    row = pygame.image.tostring(surface.subsurface((0, 0, width, 1)), "RGBA")
+    mark = row[:4]
+
+    marks = []
+    pos = row.find(mark)
+    while pos != -1:
+        if pos % 4 == 0:
+            marks.append(pos // 4)
+            pos = row.find(mark, pos + 4)
+        else:
+            pos = row.find(mark, pos + 4 - (pos % 4))
+    marks.append(width)
+
+    offsets = array("H", [0] * TABLE_SIZE)
+    widths = array("H", [0] * TABLE_SIZE)
+    for i, c in enumerate(CHAR_ORDER[:len(marks) - 1]):
+        offsets[ord(c)] = marks[i] + 1
+        widths[ord(c)] = (marks[i + 1] - marks[i]) - 1
+
+    return offsets, widths
+
+
+def save_metrics(path, metrics):
+    """Writes the ``(offsets, widths)`` tables returned by :func:`scan_glyphs` to ``path``."""
+    tables = [array("H", table) for table in metrics]
+    if sys.byteorder == "big":
+        for table in tables:
+            table.byteswap()
+
+    with open(path, "wb") as f:
+        f.write(METRICS_HEADER.pack(METRICS_MAGIC, METRICS_VERSION, len(tables), TABLE_SIZE))
+        for table in tables:
+            f.write(table.tostring())
+
+
+def load_metrics(path):
+    """Reads tables written by :func:`save_metrics` from ``path``. Returns ``None`` if the
+    file is missing, truncated, or was written by an incompatible version."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except IOError:
+        return None
+
+    return parse_metrics(data)
+
+
+def parse_metrics(data):
+    """Reads tables written by :func:`save_metrics` from the string ``data``. Returns
+    ``None`` if it is truncated or was written by an incompatible version."""
+    if len(data) < METRICS_HEADER.size:
+        return None
+
+    magic, version, count, size = METRICS_HEADER.unpack_from(data)
+    if magic != METRICS_MAGIC or version != METRICS_VERSION or count != 2 or size != TABLE_SIZE:
+        return None
+
+    tables = []
+    pos = METRICS_HEADER.size
+    for i in xrange(count):
+        table = array("H")
+        chunk = data[pos:pos + size * table.itemsize]
+        if len(chunk) != size * table.itemsize:
+            return None
+        table.fromstring(chunk)
+        if sys.byteorder == "big":
+            table.byteswap()
+        tables.append(table)
+        pos += len(chunk)
+
+    return tuple(tables)
+
+
+def wrap_text(text, width, widths):
+    """Breaks ``text`` into lines no wider than ``width`` pixels, in a single pass.
+    ``widths`` is a table of glyph widths in pixels indexed by character code;
+    characters beyond the end of the table are treated as zero-width.
+
+    Returns a list of ``(start, stop, line_width)`` tuples, one per line, where
+    ``text[start:stop]`` is the text of the line and ``line_width`` is its
+    rendered width. Lines are broken at ``"\\n"`` (which is not included in
+    any line) and otherwise after the last space that fits; a word wider than
+    ``width`` on its own is broken between characters. Spaces are allowed to
+    hang past ``width`` at the end of a line.
+
+    The running line width and the width up to the last break opportunity are
+    both kept as the text is scanned, so no part of the line is ever measured
+    twice; the cost is linear in ``len(text)``."""
+    lines = []
+
+    start = 0
+    line_w = 0
+    brk = -1
+    brk_w = 0
+
+    table_size = len(widths)
+
+    i = 0
+    n = len(text)
+    while i < n:
+        c = text[i]
+
+        if c == "\n":
+            lines.append((start, i, line_w))
+            i += 1
+            start = i
+            line_w = 0
+            brk = -1
+            continue
+
+        code = ord(c)
+        cw = widths[code] if code < table_size else 0
+
+        if line_w + cw > width and c != " " and i > start:
+            if brk > start:
+                lines.append((start, brk, brk_w))
+                line_w -= brk_w
+                start = brk
+            else:
+                lines.append((start, i, line_w))
+                line_w = 0
+                start = i
+            brk = -1
+            continue
+
+        line_w += cw
+        i += 1
+
+        if c == " ":
+            brk = i
+            brk_w = line_w
+
+    if start < n:
+        lines.append((start, n, line_w))
+
+    return lines
+
 
 class Font:
     """This class encapsulates a variable-width bitmap font.
@@ -10,33 +169,19 @@ class Font:
     by specially colored pixels in the top row. The delimiter color is taken
     from the top-left pixel in the surface; Each pixel in the top row matching
     that color indicates the break between two characters."""
-    def __init__(self, surface):
-        """Creates a new ``Font`` from ``surface``."""
+    def __init__(self, surface, metrics=None):
+        """Creates a new ``Font`` from ``surface``. ``metrics`` may be the ``(offsets, widths)``
+        tables previously returned by :func:`scan_glyphs` for the same surface; if omitted,
+        the surface is scanned."""
         self._height = surface.get_height()
+        self.image = surface
 
-        mark_color = surface.get_at((0, 0))
-
-        marks = []
-        for x in xrange(surface.get_width()):
-            color = surface.get_at((x, 0))
-            if color == mark_color:
-                marks.append(x)
-        marks.append(surface.get_width())
+        if metrics is None:
+            metrics = scan_glyphs(surface)
 
-        char_surfaces = []
-        for i in xrange(len(marks) - 1):
-            rect = (
-                marks[i] + 1,
-                0,
-                (marks[i + 1] - marks[i]) - 1,
-                self._height
-            )
+        self.offsets, self.widths = metrics
 
-            char_surfaces.append(surface.subsurface(rect))
-
-        self.char_dict = {}
-        for c, surf in zip(CHAR_ORDER, char_surfaces):
-            self.char_dict[c] = surf
+        self.text_cache = SurfaceCache()
 
     @property
     def height(self):
@@ -46,73 +191,95 @@ class Font:
 
     def line_width(self, text):
         """Returns the width in pixels that would be occupied by ``text`` if rendered as a single line."""
-        total = 0
-        for c in text:
-            surf = self.char_dict.get(c)
-            if surf is not None:
-                total += surf.get_width()
+        widths = self.widths
+        return sum([widths[code] for code in map(ord, text) if code < TABLE_SIZE])
+
+    def layout(self, text, width):
+        """Returns the line metrics for ``text`` wrapped to ``width`` pixels, as a list of
+        ``(start, stop, line_width)`` tuples; see :func:`wrap_text`. The metrics can be used
+        to measure or position text without rendering it."""
+        return wrap_text(text, width, self.widths)
+
+    def block_height(self, text, width):
+        """Returns the height in pixels of the surface :meth:`render_block` would return."""
+        return self._height * len(self.layout(text, width))
+
+    def place(self, text, lines):
+        """Returns the position of every visible glyph of ``text`` laid out as ``lines`` (as
+        returned by :meth:`layout`), as a list of ``(code, x, y)`` tuples in reading order.
+        Positions are relative to the top-left corner of the first line."""
+        widths = self.widths
+        height = self._height
+
+        glyphs = []
+        for i, (start, stop, line_w) in enumerate(lines):
+            x = 0
+            y = height * i
+            for code in map(ord, text[start:stop]):
+                if code < TABLE_SIZE and widths[code]:
+                    glyphs.append((code, x, y))
+                    x += widths[code]
 
-        return total
+        return glyphs
+
+    def render_glyph(self, code, surface, pos):
+        """Renders the single glyph for character code ``code`` onto ``surface`` at ``pos``."""
+        surface.blit(self.image, pos, (self.offsets[code], 0, self.widths[code], self._height))
 
     def render(self, text, surface, pos):
         """This method renders ``text`` onto ``surface`` with the top-left corner of the first
         character at ``pos``. This method is best used for text that changes often; direct rendering
         avoids the overhead of creating/destroying a surface every time the text changes."""
+        image = self.image
+        offsets = self.offsets
+        widths = self.widths
+        height = self._height
+
         cur_x, cur_y = pos
-        for c in text:
-            surf = self.char_dict.get(c)
-            if surf is not None:
-                surface.blit(surf, (cur_x, cur_y))
-                cur_x += surf.get_width()
+        for code in map(ord, text):
+            if code < TABLE_SIZE and widths[code]:
+                surface.blit(image, (cur_x, cur_y), (offsets[code], 0, widths[code], height))
+                cur_x += widths[code]
 
     def render_line(self, text):
         """Returns a ``pygame.Surface`` with ``text`` rendered to it as a single line. This surface
         is exactly large enough to contain the rendered text. This method is best used for text that
         will be saved and rendered many times; creating the surface allows the text to be re-used
-        many times without re-calculating and blitting each character."""
-        width = self.line_width(text)
-        surface = pygame.Surface((width, self._height), flags=pygame.SRCALPHA)
-        surface.fill((0, 0, 0, 0))
-        self.render(text, surface, (0, 0))
+        many times without re-calculating and blitting each character.
+
+        Surfaces are kept in ``self.text_cache``, so rendering the same text again only costs a
+        lookup; the returned surface is shared and must not be modified."""
+        key = ("line", text)
+
+        surface = self.text_cache.get(key)
+        if surface is None:
+            width = self.line_width(text)
+            surface = blank_like(self.image, (width, self._height))
+            self.render(text, surface, (0, 0))
+
+            self.text_cache.put(key, surface)
 
         return surface
 
     def render_block(self, text, width):
         """Returns a ``pygame.Surface`` with ``text`` rendered to it, broken into multiple lines
          so that the rendered text is not wider than ``width``. The surface will be ``width`` pixels
-         wide, and its height will be a multiple of ``self.height``."""
-        lines = []
-        line_start = 0
-        line_stop = 0
-        while line_start < len(text):
-            line_stop += 1
-
-            if line_stop >= len(text):
-                line_stop = len(text)
-                lines.append(text[line_start:line_stop])
-                line_start = line_stop
-
-            elif text[line_stop] == "\n":
-                lines.append(text[line_start:line_stop])
-                line_start = line_stop
-
-            elif self.line_width(text[line_start:line_stop]) > width:
-                line_stop -= 1
-
-                while text[line_stop - 1] != " " and line_stop != len(text):
-                    original_stop = line_stop
-                    line_stop -= 1
-                    if line_stop <= line_start:
-                        line_stop = original_stop
-                        break
-
-                lines.append(text[line_start:line_stop])
-                line_start = line_stop
-
-        surface = pygame.Surface((width, self._height * len(lines)), pygame.SRCALPHA)
-        surface.fill((0, 0, 0, 0))
-
-        for i, line in enumerate(lines):
-            self.render(line, surface, (0, self._height * i))
-
-        return surface
\ No newline at end of file
+         wide, and its height will be a multiple of ``self.height``.
+
+         Like :meth:`render_line`, the result is cached and shared and must not be modified."""
+        key = ("block", text, width)
+
+        surface = self.text_cache.get(key)
+        if surface is not None:
+            return surface
+
+        lines = self.layout(text, width)
+
+        surface = blank_like(self.image, (width, self._height * len(lines)))
+
+        for i, (start, stop, line_w) in enumerate(lines):
+            self.render(text[start:stop], surface, (0, self._height * i))
+
+        self.text_cache.put(key, surface)
+
+        return surface
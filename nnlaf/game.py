@@ -2,7 +2,12 @@ import pygame
 
 from rect import Rect
 from controller import Controller
+from events import EventPump
+from memory import MemoryTracker
+from surface_format import display_format
+from sound import SoundManager, MusicPlayer
 from player import Player
+from world_model import KINDS
 
 
 class MainMenu:
@@ -64,9 +69,10 @@ class Zone:
 
         self.screen = self.game.screen
 
-        self.battles = [x for x in game.battles if x.zone == self.zone]
-        self.targets = [x for x in game.targets if x.zone == self.zone]
-        self.terrain = [x for x in game.terrain if x.zone == self.zone]
+        api = game.core.script_api
+        self.battles = list(api.zone_objects(zone, "battles"))
+        self.targets = list(api.zone_objects(zone, "targets"))
+        self.terrain = list(api.zone_objects(zone, "terrain"))
 
         # Determine the size required for the map surface
         map_size_rect = Rect()
@@ -85,7 +91,9 @@ class Zone:
             if tar.static:
                 tar.draw(self.map_surface)
 
-    def draw(self):
+        self.map_surface = display_format(self.map_surface)
+
+    def draw(self, alpha=1.0):
         self.screen.blit(self.map_surface, (0, 0))
 
     def update(self):
@@ -94,14 +102,30 @@ class Zone:
 
 class Game:
     """This class represents the highest level of the game logic, managing the
-    other more specific components of the game."""
-    def __init__(self, core):
+    other more specific components of the game.
+
+    If ``audit`` is ``True``, the screen is wrapped in a :class:`BlitAudit
+    <surface_format.BlitAudit>` that logs the formats of the surfaces blitted each frame."""
+    def __init__(self, core, audit=False):
         self.core = core
         self.running = True
 
         self.screen = pygame.display.get_surface()
 
+        self.audit = None
+        if audit:
+            from surface_format import BlitAudit
+            self.audit = self.screen = self.core.screen = BlitAudit(self.screen)
+
+        self.events = EventPump()
+        self.events.subscribe(self.quit, pygame.QUIT)
+        self.events.subscribe(self.debug_key, pygame.KEYDOWN)
+
         self.controller = Controller()
+        self.controller.attach(self.events)
+
+        self.sound = SoundManager(self.core)
+        self.core.music = MusicPlayer(self.core, self.sound)
         
         self.main_menu = MainMenu(self)
         self.game_menu = GameMenu(self)
@@ -109,35 +133,162 @@ class Game:
         self.show_main_menu = True
         self.show_game_menu = False
 
-        self.battles = []
-        self.targets = []
-        self.terrain = []
+        self.world = self.core.script_api.world
 
         ########
-        from world_model import Terrain
         terrain_image = self.core.get_image("canister_apartment.png")
-        test_terrain = Terrain()
-        test_terrain.add_image(terrain_image)
+        test_terrain = self.core.script_api.select_terrain("test_apartment")
+        if not test_terrain.images:
+            test_terrain.add_image(terrain_image)
         test_terrain.zone = "apartment"
-        self.terrain.append(test_terrain)
         ########
 
-        self.zone = Zone(self, "apartment")
+        self.memory = MemoryTracker()
+
+        self.zone = None
+        self.enter_zone("apartment")
         self.dialogue = None
 
-    def fast_step(self):
-        self.update()
+        self.watcher = None
+        self.watch_interval = 30
+
+        self.saves = None
+
+    def watch_files(self, interval=30):
+        """Starts polling the data directory for changed files every ``interval`` updates,
+        and reloading whatever they affect; see :meth:`hot_reload`."""
+        from core import FileWatcher
+        self.watcher = FileWatcher(self.core.data_dir, self.core.file_map)
+        self.watch_interval = interval
+
+    def hot_reload(self, changed):
+        """Reloads the files named in ``changed`` while the game keeps running. Changed
+        scripts are run again; for any other file, only the ``Core`` cache entries derived
+        from it are dropped. Terrain holding a dropped image is given the reloaded one, and
+        the current zone is rebuilt only if something it contains was affected: a script
+        counts only if it added, changed or removed objects in the current zone."""
+        old_images = {}
+        fonts_changed = False
+
+        for fn in changed:
+            if fn.endswith(".py"):
+                continue
+            for key, value in self.core.invalidate(fn):
+                if key[0] == "image":
+                    old_images[id(value)] = fn
+                elif key[0] == "font":
+                    fonts_changed = True
+
+        affected_zones = set()
+
+        scripts = [fn for fn in changed if fn.endswith(".py") and fn in self.core.file_map]
+        if scripts:
+            before = self.zone_state()
+            for fn in scripts:
+                print "GAME: Hot reload: running {}".format(fn)
+                self.core.load_script(self.core.file_map[fn])
+            if self.zone is not None and self.zone_state() != before:
+                affected_zones.add(self.zone.zone)
+
+        if old_images:
+            for terrain in self.world.by_id["terrain"].values():
+                images = []
+                replaced = False
+                for image in terrain.images:
+                    fn = old_images.get(id(image))
+                    if fn is not None and fn in self.core.file_map:
+                        image = self.core.get_image(fn)
+                        replaced = True
+                    images.append(image)
+                if replaced:
+                    terrain.images = images
+                    affected_zones.add(terrain.zone)
+
+        if fonts_changed:
+            self.main_menu = MainMenu(self)
+
+        if self.zone is not None and self.zone.zone in affected_zones:
+            print "GAME: Hot reload: rebuilding zone {}".format(self.zone.zone)
+            self.enter_zone(self.zone.zone)
+
+    def zone_state(self):
+        """Returns a value that compares equal for two calls unless an object was added to,
+        changed in or removed from the current zone in between."""
+        if self.zone is None:
+            return None
+
+        state = []
+        for kind in KINDS:
+            for obj in self.world.in_zone(self.zone.zone, kind):
+                state.append((kind, obj.obj_id, obj.x, obj.y, obj.w, obj.h, getattr(obj, "static", None),
+                              tuple(id(image) for image in getattr(obj, "images", ()))))
+        return state
+
+    def enter_zone(self, zone):
+        """Replaces the current zone with a new :class:`Zone` for ``zone``, lets the
+        :class:`MemoryTracker <memory.MemoryTracker>` snapshot the heap, and saves the
+        game if saving is enabled."""
+        self.zone = None
+        self.zone = Zone(self, zone)
+        self.memory.zone_entered(zone)
+
+        if self.saves is not None:
+            self.saves.save(self)
+
+    def enable_saves(self, path, load=False):
+        """Starts saving the game to ``path`` in the background at every zone transition
+        and when F5 is pressed; see :class:`SaveManager <save.SaveManager>`. If ``load``
+        is ``True``, the state already saved there is restored first; otherwise an existing
+        save is left alone and the game is saved next to it under a new name."""
+        from save import SaveManager, SaveFormatError, session_path
+        if not load:
+            path = session_path(path)
+        saves = SaveManager(path)
+        if load:
+            try:
+                if saves.load(self):
+                    print "GAME: Loaded {}".format(path)
+            except SaveFormatError as e:
+                print "GAME: Could not load save: {}".format(e)
+                saves.path = session_path(path)
+        saves.begin(self)
+        print "GAME: Saving to {}".format(saves.path)
+        self.saves = saves
+
+    def close(self):
+        """Finishes any save still being written."""
+        if self.saves is not None:
+            self.saves.close()
+            self.saves = None
+
+    def show_dialogue(self, text):
+        """Opens a :class:`Dialogue <dialogue.Dialogue>` box showing ``text``; the zone
+        stops updating until the player has read through it."""
+        from dialogue import Dialogue
+        self.dialogue = Dialogue(self, text)
+
+    def quit(self, event):
+        self.running = False
+
+    def debug_key(self, event):
+        if event.key == pygame.K_F9:
+            print self.memory.report(self)
+        elif event.key == pygame.K_F5 and self.saves is not None:
+            self.saves.save(self)
+            print "GAME: Saved in {:.2f} ms".format(self.saves.last_snapshot_ms)
 
-    def step(self):
-        self.update()
-        self.draw()
-        
     def update(self):
-        for event in pygame.event.get(pygame.QUIT):
-            if event.type == pygame.QUIT:
-                self.running = False
-
         self.controller.update()
+        self.events.pump()
+        if self.controller.latency is not None:
+            self.controller.latency.drained()
+
+        self.core.music.update()
+
+        if self.watcher is not None and self.controller.frame % self.watch_interval == 0:
+            changed = self.watcher.poll()
+            if changed:
+                self.hot_reload(changed)
 
         if self.controller.just_pressed("START"):
             self.show_main_menu = not self.show_main_menu
@@ -160,17 +311,23 @@ class Game:
         if self.controller.just_pressed("Y"):
             self.show_game_menu = True
 
-    def draw(self):
+    def draw(self, alpha=1.0):
+        """Draws the current state of the game; ``alpha`` is the fraction of a
+        simulation step elapsed since the last ``update()``, and is passed on so
+        that moving objects can be interpolated between simulation states."""
         self.screen.fill((0, 0, 0))
 
         if self.zone is not None:
-            self.zone.draw()
+            self.zone.draw(alpha)
 
         if self.dialogue is not None:
-            self.zone.draw()
+            self.dialogue.draw()
         
         if self.show_game_menu:
             self.game_menu.draw()
 
         if self.show_main_menu:
             self.main_menu.draw()
+
+        if self.audit is not None:
+            self.audit.end_frame()
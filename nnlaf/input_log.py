@@ -0,0 +1,98 @@
+"""This module contains :class:`InputRecorder` and :class:`InputPlayer`, which save
+and restore the per-frame state of a :class:`Controller <controller.Controller>`.
+
+Input logs are binary files: a header followed by run-length encoded frames.
+Each run is a frame count and a bitfield of the pressed buttons, where bit ``n``
+is set when button ``n`` of ``controller.BUTTONS`` is pressed. A player who
+holds a direction for a few seconds costs one run, not hundreds of frames."""
+
+import os
+import struct
+
+LOG_MAGIC = "NNIR"
+LOG_VERSION = 1
+LOG_HEADER = struct.Struct("<4sHH")
+LOG_RUN = struct.Struct("<IH")
+
+
+class InputRecorder:
+    """Writes one controller bitfield per frame to the file at ``path``. Runs are
+    written as soon as they end, so little is lost if the game crashes."""
+    def __init__(self, path, button_count):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.file = open(path, "wb")
+        self.file.write(LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION, button_count))
+
+        self.mask = None
+        self.count = 0
+        self.frames = 0
+
+    def record(self, mask):
+        """Appends one frame with the buttons in ``mask`` pressed."""
+        if mask == self.mask:
+            self.count += 1
+        else:
+            self._flush_run()
+            self.mask = mask
+            self.count = 1
+
+        self.frames += 1
+
+    def _flush_run(self):
+        if self.count > 0:
+            self.file.write(LOG_RUN.pack(self.count, self.mask))
+
+    def close(self):
+        """Writes the final run and closes the file."""
+        self._flush_run()
+        self.count = 0
+        self.file.close()
+
+
+class InputPlayer:
+    """Reads a file written by :class:`InputRecorder` and returns its frames one at
+    a time from :meth:`next`. The whole log is decoded into runs when it is opened;
+    playback itself does no I/O."""
+    def __init__(self, path, button_count):
+        with open(path, "rb") as f:
+            data = f.read()
+
+        if len(data) < LOG_HEADER.size:
+            raise ValueError("Input log {} is truncated".format(path))
+
+        magic, version, count = LOG_HEADER.unpack_from(data)
+        if magic != LOG_MAGIC or version != LOG_VERSION:
+            raise ValueError("Input log {} has an unsupported format".format(path))
+        if count != button_count:
+            raise ValueError("Input log {} was recorded with {} buttons, not {}".format(path, count, button_count))
+
+        self.runs = []
+        for pos in xrange(LOG_HEADER.size, len(data) - LOG_RUN.size + 1, LOG_RUN.size):
+            self.runs.append(LOG_RUN.unpack_from(data, pos))
+
+        self.frames = sum(run[0] for run in self.runs)
+
+        self.run_index = 0
+        self.run_left = self.runs[0][0] if self.runs else 0
+        self.frame = 0
+
+    @property
+    def done(self):
+        """``True`` once every recorded frame has been returned."""
+        return self.frame >= self.frames
+
+    def next(self):
+        """Returns the bitfield for the next frame, or ``0`` once the log is exhausted."""
+        if self.done:
+            return 0
+
+        while self.run_left == 0:
+            self.run_index += 1
+            self.run_left = self.runs[self.run_index][0]
+
+        self.run_left -= 1
+        self.frame += 1
+        return self.runs[self.run_index][1]
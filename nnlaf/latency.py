@@ -0,0 +1,104 @@
+"""This module contains :class:`LatencyMonitor`, which measures input-to-photon
+latency: the time from the :class:`Controller <controller.Controller>` receiving
+an input event to the first ``display.flip()`` that shows its effect."""
+
+from timeit import default_timer
+
+from controller import BUTTONS, BUTTON_BITS
+
+
+class LatencyMonitor:
+    """This class collects a latency histogram for every controller button, and
+    splits each sample into three parts:
+
+    *   **wait**: time the event may have spent in the queue, from the end of the
+        previous drain of the event queue to the event being received. pygame's
+        events carry no timestamp, so the event arrived at some point in that
+        span and this is an upper bound.
+    *   **update**: time from the event being received to the end of the
+        ``update()`` that received it.
+    *   **draw**: time from the end of that update to the end of the next
+        ``display.flip()``.
+
+    :func:`main.run` calls :meth:`end_update` and :meth:`presented`; the
+    controller calls :meth:`received` for each button changed by an event, and
+    :meth:`drained` is called once the event queue has been drained. Histogram buckets are ``bucket_ms`` wide; the last
+    bucket collects everything beyond the others."""
+    def __init__(self, bucket_ms=1.0, buckets=100):
+        self.bucket_ms = bucket_ms
+        self.buckets = buckets
+
+        self.histograms = dict((button, [0] * buckets) for button in BUTTONS)
+        self.totals = dict((button, [0, 0.0, 0.0, 0.0]) for button in BUTTONS)
+
+        self.names = dict((bit, button) for button, bit in BUTTON_BITS.items())
+
+        self.last_drain = None
+        self.received_this_update = []
+        self.awaiting_flip = []
+
+    def drained(self):
+        """Called after each drain of the event queue."""
+        self.last_drain = default_timer()
+
+    def received(self, bit):
+        now = default_timer()
+        wait = 0.0 if self.last_drain is None else now - self.last_drain
+        self.received_this_update.append((self.names[bit], now, wait))
+
+    def end_update(self):
+        if self.received_this_update:
+            now = default_timer()
+            for button, received, wait in self.received_this_update:
+                self.awaiting_flip.append((button, wait, now - received, now))
+            del self.received_this_update[:]
+
+    def presented(self):
+        if not self.awaiting_flip:
+            return
+
+        now = default_timer()
+        for button, wait, update, update_end in self.awaiting_flip:
+            draw = now - update_end
+            total_ms = (wait + update + draw) * 1000.0
+
+            bucket = min(int(total_ms / self.bucket_ms), self.buckets - 1)
+            self.histograms[button][bucket] += 1
+
+            totals = self.totals[button]
+            totals[0] += 1
+            totals[1] += wait * 1000.0
+            totals[2] += update * 1000.0
+            totals[3] += draw * 1000.0
+
+        del self.awaiting_flip[:]
+
+    def percentile(self, button, fraction):
+        """Returns the upper edge, in ms, of the histogram bucket containing the ``fraction``
+        percentile of the samples for ``button``, or ``None`` if there are none."""
+        histogram = self.histograms[button]
+        count = sum(histogram)
+        if count == 0:
+            return None
+
+        seen = 0
+        for i, n in enumerate(histogram):
+            seen += n
+            if seen >= fraction * count:
+                return (i + 1) * self.bucket_ms
+
+    def report(self):
+        """Returns a multi-line string summarizing the latency of every button that was used."""
+        lines = ["button   samples   p50 ms   p95 ms   wait ms   update ms   draw ms"]
+        for button in BUTTONS:
+            count, wait, update, draw = self.totals[button]
+            if count == 0:
+                continue
+
+            lines.append("{:<8} {:>7}   {:>6.1f}   {:>6.1f}   {:>7.2f}   {:>9.2f}   {:>7.2f}".format(
+                button, count,
+                self.percentile(button, 0.5), self.percentile(button, 0.95),
+                wait / count, update / count, draw / count,
+            ))
+
+        return "\n".join(lines)
@@ -0,0 +1,224 @@
+"""This module contains the binary level format: :func:`export_level` writes the
+world objects and strings held by a :class:`ScriptAPI <script_api.ScriptAPI>` to
+a single file, and :class:`LevelFile` memory-maps such a file and builds the
+objects of one zone at a time, only when they are asked for.
+
+A level file is laid out as a header followed by fixed-size tables and then a
+blob of UTF-8 string data; every name, id, zone and image reference is an index
+into the string table. Objects are sorted by zone so each zone is one
+contiguous slice of the object table."""
+
+import mmap
+import struct
+
+from world_model import Battle, Target, Terrain
+
+LEVEL_MAGIC = "NNLV"
+LEVEL_VERSION = 1
+
+HEADER = struct.Struct("<4sHHIIIIII")
+STRING = struct.Struct("<II")
+OBJECT = struct.Struct("<BBIIddddBIH")
+IMAGE = struct.Struct("<I")
+ZONE = struct.Struct("<III")
+NAMED = struct.Struct("<II")
+
+NO_STRING = 0xFFFFFFFF
+
+KINDS = ("battles", "targets", "terrain")
+CLASSES = (Battle, Target, Terrain)
+
+ID_STR = 0
+ID_INT = 1
+
+
+class LevelFormatError(Exception):
+    pass
+
+
+def export_level(script_api, path):
+    """Writes every battle, target and terrain object in ``script_api``, plus the strings
+    added with ``add_string``, to a level file at ``path``. Terrain images are stored by
+    file name, so every image must have been loaded through ``Core.get_image``.
+
+    Objects are loaded from a level file by zone, so objects without a zone are left
+    out, with a warning for each. Ids must be ``int`` or ``str``; any other id raises
+    :class:`LevelFormatError`."""
+    image_names = {}
+    for key, value in script_api._core.cache.items():
+        if key[0] == "image":
+            image_names[id(value)] = key[1]
+
+    strings = []
+    string_index = {}
+
+    def intern(s):
+        if s is None:
+            return NO_STRING
+        if isinstance(s, unicode):
+            s = s.encode("utf-8")
+        if s not in string_index:
+            string_index[s] = len(strings)
+            strings.append(s)
+        return string_index[s]
+
+    rows = []
+    for kind_n, kind in enumerate(KINDS):
+        for obj_id, obj in getattr(script_api, kind).items():
+            if not isinstance(obj_id, (int, long, basestring)):
+                raise LevelFormatError("{} object {!r} has an id that is not an int or a string".format(kind, obj_id))
+            if obj.zone is None:
+                print "LEVEL: Leaving out {} object {!r}, which is not in any zone".format(kind, obj_id)
+                continue
+            rows.append((obj.zone, kind_n, obj_id, obj))
+    rows.sort(key=lambda row: (row[0], row[1]))
+
+    objects = []
+    images = []
+    zones = []
+    for zone, kind_n, obj_id, obj in rows:
+        if isinstance(obj_id, (int, long)):
+            id_type, id_str = ID_INT, intern(str(obj_id))
+        else:
+            id_type, id_str = ID_STR, intern(obj_id)
+
+        image_first = len(images)
+        for image in getattr(obj, "images", ()):
+            name = image_names.get(id(image))
+            if name is None:
+                raise LevelFormatError("Terrain {!r} has an image not loaded by Core.get_image".format(obj_id))
+            images.append(intern(name))
+
+        zone_str = intern(zone)
+        if not zones or zones[-1][0] != zone_str:
+            zones.append([zone_str, len(objects), 0])
+        zones[-1][2] += 1
+
+        objects.append(OBJECT.pack(
+            kind_n, id_type, id_str, zone_str,
+            obj.x, obj.y, obj.w, obj.h,
+            getattr(obj, "static", False), image_first, len(images) - image_first,
+        ))
+
+    named = []
+    for name, value in script_api.strings.added.items():
+        named.append(NAMED.pack(intern(name), intern(value)))
+
+    blob = []
+    blob_size = 0
+    string_table = []
+    for s in strings:
+        string_table.append(STRING.pack(blob_size, len(s)))
+        blob.append(s)
+        blob_size += len(s)
+
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(
+            LEVEL_MAGIC, LEVEL_VERSION, 0,
+            len(strings), len(objects), len(images), len(zones), len(named), blob_size,
+        ))
+        f.write("".join(string_table))
+        f.write("".join(objects))
+        f.write("".join(IMAGE.pack(i) for i in images))
+        f.write("".join(ZONE.pack(*zone) for zone in zones))
+        f.write("".join(named))
+        f.write("".join(blob))
+
+
+class LevelFile:
+    """This class gives read access to a level file written by :func:`export_level`.
+    The file is memory-mapped; opening it only reads the header and the zone table,
+    and objects are built from the mapped data by :meth:`load_zone` on demand. If
+    ``data`` is given, such as a buffer from a :class:`PackFile <pack.PackFile>`, it
+    is read instead of the file at ``path``."""
+    def __init__(self, path, data=None):
+        self.path = path
+
+        self.owns_data = data is None
+        if data is None:
+            with open(path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.data = data
+
+        if len(self.data) < HEADER.size:
+            raise LevelFormatError("Level file {} is truncated".format(path))
+
+        (magic, version, reserved, self.n_strings, self.n_objects, self.n_images,
+         self.n_zones, self.n_named, blob_size) = HEADER.unpack_from(self.data)
+
+        if magic != LEVEL_MAGIC or version != LEVEL_VERSION:
+            raise LevelFormatError("Level file {} has an unsupported format".format(path))
+
+        self.strings_at = HEADER.size
+        self.objects_at = self.strings_at + STRING.size * self.n_strings
+        self.images_at = self.objects_at + OBJECT.size * self.n_objects
+        self.zones_at = self.images_at + IMAGE.size * self.n_images
+        self.named_at = self.zones_at + ZONE.size * self.n_zones
+        self.blob_at = self.named_at + NAMED.size * self.n_named
+
+        if len(self.data) < self.blob_at + blob_size:
+            raise LevelFormatError("Level file {} is truncated".format(path))
+
+        self.zones = {}
+        for n in xrange(self.n_zones):
+            zone_str, first, count = ZONE.unpack_from(self.data, self.zones_at + ZONE.size * n)
+            self.zones[self.string(zone_str)] = (first, count)
+
+        self.named = None
+
+    def close(self):
+        if self.owns_data:
+            self.data.close()
+
+    def string(self, n):
+        """Returns string number ``n`` from the string table, or ``None`` for ``NO_STRING``."""
+        if n == NO_STRING:
+            return None
+        offset, length = STRING.unpack_from(self.data, self.strings_at + STRING.size * n)
+        start = self.blob_at + offset
+        return self.data[start:start + length]
+
+    def get_string(self, name):
+        """Returns the string stored under ``name``, or ``None`` if there is none. The name
+        table is read the first time this is called."""
+        if self.named is None:
+            self.named = {}
+            for n in xrange(self.n_named):
+                name_str, value_str = NAMED.unpack_from(self.data, self.named_at + NAMED.size * n)
+                self.named[self.string(name_str)] = value_str
+
+        value_str = self.named.get(name)
+        if value_str is None:
+            return None
+        return self.string(value_str)
+
+    def load_zone(self, zone, get_image):
+        """Builds the objects of ``zone`` and returns them as a list of ``(kind, id, object)``
+        tuples. ``get_image`` is called with each image file name, normally ``Core.get_image``."""
+        if zone not in self.zones:
+            return []
+
+        first, count = self.zones[zone]
+
+        loaded = []
+        for n in xrange(first, first + count):
+            (kind_n, id_type, id_str, zone_str, x, y, w, h,
+             static, image_first, image_count) = OBJECT.unpack_from(self.data, self.objects_at + OBJECT.size * n)
+
+            obj = CLASSES[kind_n]()
+            obj.x, obj.y, obj.w, obj.h = [int(v) if v.is_integer() else v for v in (x, y, w, h)]
+            obj.zone = zone
+
+            if kind_n == 2:
+                obj.static = bool(static)
+                for i in xrange(image_first, image_first + image_count):
+                    name_str, = IMAGE.unpack_from(self.data, self.images_at + IMAGE.size * i)
+                    obj.images.append(get_image(self.string(name_str)))
+
+            obj_id = self.string(id_str)
+            if id_type == ID_INT:
+                obj_id = int(obj_id)
+
+            loaded.append((KINDS[kind_n], obj_id, obj))
+
+        return loaded
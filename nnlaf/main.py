@@ -5,32 +5,52 @@ directly by the python interpreter, it will call the ``main()`` function."""
 
 import os
 import sys
+import math
 import pygame
 
 game_path = os.path.dirname(os.path.realpath(os.path.abspath(__file__)))
 data_path = os.path.join(game_path, 'data')
 save_path = os.path.join(game_path, 'save')
+pack_path = os.path.join(game_path, 'data.pack')
 
 
-def run(that, fps=60.0, check=lambda x: x.running):
-    """Run ``that`` in a timed loop, calling ``that.step()`` and/or
-    ``that.fast_step()`` at ``fps`` times per second until ``check(that)``
-    returns ``False``.
-    
+def run(that, fps=60.0, check=lambda x: x.running, max_updates=5, monitor=None, first_frame=None, max_fps=120.0):
+    """Run ``that`` in a timed loop until ``check(that)`` returns ``False``.
+    Simulation and rendering are decoupled: ``that.update()`` is called at a
+    fixed rate of ``fps`` times per second, while ``that.draw(alpha)`` is called
+    once per loop iteration, at most ``max_fps`` times per second.
+
+    Between iterations the loop sleeps until the next frame is due, so it does
+    not spin a CPU core, while still drawing interpolated frames between
+    updates. If ``max_fps`` is ``None``, frames are drawn as fast as the display
+    allows and the loop never sleeps.
+
     The default check function simply returns the value of ``that.running``
     so ``that`` can terminate itself internally by setting ``self.running``
     to ``False``.
-    
-    If the loop is running on time, ``that.step()`` is called. If the loop is
-    running slowly, ``that.fast_step()`` is called instead; ``fast_step()`` is
-    assumed to take less time than ``step()`` so that the loop can catch up.
-    
+
+    Elapsed time is gathered in an accumulator and spent in fixed slices of
+    ``1000.0 / fps`` milliseconds, so game speed does not drift when frames are
+    slow. At most ``max_updates`` updates are run per rendered frame; if the
+    loop falls further behind than that, the excess time is dropped rather
+    than letting the simulation spiral.
+
+    ``alpha`` is the fraction of a simulation step that has elapsed since the
+    last ``update()``, in the range ``[0.0, 1.0)``; ``draw`` should use it to
+    interpolate between the previous and current simulation states.
+
+    If ``monitor`` is given, it is told when each update ends and when each
+    frame has been flipped to the display; see
+    :class:`LatencyMonitor <latency.LatencyMonitor>`. If ``first_frame`` is given,
+    it is called once, right after the first frame has been flipped.
+
     Returns ``that`` for slick one-liners."""
 
     interval = 1000.0 / fps
+    frame_interval = None if max_fps is None else 1000.0 / max_fps
 
     curr_tick = pygame.time.get_ticks()
-    tick_accum = 0
+    tick_accum = 0.0
 
     while check(that):
         prev_tick = curr_tick
@@ -38,38 +58,230 @@ def run(that, fps=60.0, check=lambda x: x.running):
         tick_delta = curr_tick - prev_tick
         tick_accum += tick_delta
 
-        if tick_accum > interval:
+        updates = 0
+        while tick_accum >= interval and check(that):
             tick_accum -= interval
 
-            if tick_accum < interval:
-                that.step()
-            else:
-                that.fast_step()
+            that.update()
+
+            if monitor is not None:
+                monitor.end_update()
+
+            updates += 1
+            if updates >= max_updates:
+                tick_accum %= interval
+                break
+
+        that.draw(tick_accum / interval)
 
         pygame.display.flip()
-        pygame.time.wait(1)
+
+        if monitor is not None:
+            monitor.presented()
+
+        if first_frame is not None:
+            first_frame()
+            first_frame = None
 
         sys.stdout.flush()
 
+        if frame_interval is not None:
+            idle = frame_interval - (pygame.time.get_ticks() - curr_tick)
+            if idle > 0.0:
+                pygame.time.wait(int(math.ceil(idle)))
+
     return that
 
 
-def main():
+def run_headless(that, check=lambda x: x.running):
+    """Run ``that`` as fast as possible, calling ``that.update()`` and then
+    ``that.draw(1.0)`` until ``check(that)`` returns ``False``. There is no
+    timing and no ``display.flip()``, so this is meant for replays and
+    benchmarks rather than play.
+
+    Returns ``that`` for slick one-liners."""
+
+    while check(that):
+        that.update()
+        that.draw(1.0)
+
+    return that
+
+
+def parse_args(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Ninmu Nanmu: Love and Freedom")
+    parser.add_argument("--record", metavar="NAME",
+                        help="record controller input to NAME in the save directory")
+    parser.add_argument("--replay", metavar="NAME",
+                        help="replay controller input from NAME in the save directory, headless and untimed")
+    parser.add_argument("--export-level", metavar="PATH",
+                        help="run every data script, write the resulting world to a level file at PATH and exit")
+    parser.add_argument("--export-strings", metavar="PATH",
+                        help="run every data script, write the strings they add to a string table at PATH and exit")
+    parser.add_argument("--watch", action="store_true",
+                        help="reload changed scripts and assets from the data directory while running")
+    parser.add_argument("--loose", action="store_true",
+                        help="read assets from the data directory even if a packed archive exists")
+    parser.add_argument("--max-fps", metavar="N", type=float, default=120.0,
+                        help="draw at most N frames per second, 0 for no limit (default: 120)")
+    parser.add_argument("--latency", action="store_true",
+                        help="measure input-to-photon latency and print a report on exit")
+    parser.add_argument("--music-log", action="store_true",
+                        help="print each music switch and the time it took on the main thread")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="print the time taken by each startup phase and import once the game is running")
+    parser.add_argument("--memory-report", action="store_true",
+                        help="track heap growth across zone transitions and print a memory report on exit")
+    parser.add_argument("--audit-blits", action="store_true",
+                        help="log the pixel formats of the surfaces blitted each frame and print a summary on exit")
+    parser.add_argument("--save", metavar="NAME", default="autosave.save",
+                        help="save the game to NAME in the save directory, or next to it under a new name "
+                             "if it exists and --continue is not given (default: autosave.save)")
+    parser.add_argument("--continue", dest="load", action="store_true",
+                        help="restore the game from the save before playing")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
     """Main entry point for the game; initializes pygame, creates the
-    :class:`Core <core.Core>`, and then starts the :class:`Game <game.Game>`\ ."""
-    
-    pygame.mixer.pre_init(44100, -16, 2, 1024)
-    pygame.init()
-    pygame.display.set_mode((640, 480))
+    :class:`Core <core.Core>`, and then starts the :class:`Game <game.Game>`\ .
+
+    With ``--record NAME`` the controller input of the session is saved to
+    ``NAME`` in the save directory. With ``--replay NAME`` that input is played
+    back with dummy video and audio drivers as fast as possible, and the time
+    taken is reported; see :mod:`input_log`.
+
+    Except during a replay, the game is saved in the background to ``--save NAME``
+    in the save directory; ``--continue`` restores that save first. Without
+    ``--continue`` an existing save is never replaced; the new game is saved under
+    a name with the date and time added. See :mod:`save`.
+
+    Startup is split into phases recorded by the :class:`StartupTimeline
+    <startup.StartupTimeline>`. Only the display is started before the first
+    frame; the data directory is walked in the background, and the mixer and
+    joystick are started once the loading screen is up, or on first use.
+    ``--startup-report`` prints the timeline.
+
+    Assets are read from ``data.pack`` if it exists (see :mod:`pack`), unless
+    ``--loose``, ``--watch`` or an export asks for the data directory itself. With
+    ``--watch`` the level file is not used either, so every world object comes from
+    the data scripts that are being watched."""
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    from startup import timeline, init_display, ensure_mixer, ensure_joystick
+
+    if args.startup_report:
+        timeline.track_imports()
+
+    def startup_done(name):
+        timeline.mark(name)
+        if args.startup_report:
+            timeline.stop_tracking_imports()
+            print timeline.report()
+
+    exporting = args.export_level or args.export_strings
+    headless = args.replay or exporting
+
+    if headless:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+        os.environ["SDL_AUDIODRIVER"] = "dummy"
+
+    use_pack = not (args.loose or args.watch or exporting) and os.path.exists(pack_path)
 
     from core import Core
-    core = run(Core(data_path, save_path))
+    with timeline.phase("core"):
+        core = Core(data_path, save_path, use_level=not (exporting or args.watch),
+                    pack_path=pack_path if use_pack else None)
+
+    init_display((640, 480))
+
+    def loading_shown():
+        timeline.mark("first frame")
+        timeline.run_deferred()
+
+    with timeline.phase("loading"):
+        if headless:
+            run_headless(core)
+        else:
+            timeline.defer(ensure_mixer)
+            timeline.defer(ensure_joystick)
+            run(core, first_frame=loading_shown)
 
     if not core.ready:
         sys.exit("Core failed to load; launch aborted.")
 
+    if exporting:
+        if args.export_level:
+            from level import export_level
+            export_level(core.script_api, args.export_level)
+            print "Exported level to {}".format(args.export_level)
+
+        if args.export_strings:
+            from strings import write_string_table
+            write_string_table(args.export_strings, core.script_api.strings.added)
+            print "Exported strings to {}".format(args.export_strings)
+
+        startup_done("exported")
+        return
+
     from game import Game
-    game = run(Game(core))
+    with timeline.phase("game"):
+        game = Game(core, audit=args.audit_blits)
+
+    if args.memory_report:
+        game.memory.start_tracking(game.zone.zone)
+
+    if args.replay:
+        game.controller.start_replay(os.path.join(save_path, args.replay))
+        startup_done("replay started")
+
+        start = pygame.time.get_ticks()
+        run_headless(game, lambda x: x.running and not x.controller.replay_done)
+        elapsed = pygame.time.get_ticks() - start
+
+        frames = game.controller.player.frames
+        print "Replayed {} frames in {} ms ({:.1f}x real time)".format(
+            frames, elapsed, (frames * 1000.0 / 60.0) / max(elapsed, 1)
+        )
+        game.controller.stop()
+
+        if args.memory_report:
+            print game.memory.report(game)
+        return
+
+    game.enable_saves(os.path.join(save_path, args.save), load=args.load)
+
+    if args.music_log:
+        game.core.music.verbose = True
+
+    if args.record:
+        game.controller.start_recording(os.path.join(save_path, args.record))
+
+    if args.watch:
+        game.watch_files()
+
+    monitor = None
+    if args.latency:
+        from latency import LatencyMonitor
+        monitor = LatencyMonitor()
+        game.controller.latency = monitor
+
+    run(game, monitor=monitor, first_frame=lambda: startup_done("first game frame"),
+        max_fps=args.max_fps or None)
+    game.controller.stop()
+    game.close()
+
+    if monitor is not None:
+        print monitor.report()
+
+    if args.memory_report:
+        print game.memory.report(game)
+
+    if game.audit is not None:
+        print game.audit.report()
 
     print game.running
 
@@ -0,0 +1,168 @@
+"""This module contains the :class:`MemoryTracker` class, which accounts for the
+memory held by the game's caches, zone and strings, and compares snapshots of
+the Python heap taken at zone transitions to catch leaks early."""
+
+import gc
+import sys
+import pygame
+
+from collections import Counter
+
+from font import Font
+from sprite_sheet import SpriteSheet
+from surface_cache import SurfaceCache
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def surface_bytes(surface):
+    """Returns ``(own, shared)`` bytes of pixel data for ``surface``; a subsurface owns
+    nothing, since its pixels belong to its parent."""
+    size = SurfaceCache.surface_bytes(surface)
+    if surface.get_parent() is not None:
+        return 0, size
+    return size, 0
+
+
+def sound_bytes(sound):
+    """Returns the number of bytes of decoded samples held by ``sound``."""
+    frequency, format, channels = pygame.mixer.get_init()
+    return int(sound.get_length() * frequency) * channels * (abs(format) // 8)
+
+
+def value_bytes(value):
+    """Returns ``(own, shared)`` bytes for a value stored in ``Core.cache``. A font's glyph
+    sheet and a sprite sheet's frames are also cached as images or tiles, so they are
+    counted as shared; what the font or sheet owns is its rendered text or effects."""
+    if isinstance(value, pygame.Surface):
+        return surface_bytes(value)
+
+    if isinstance(value, list):
+        own = shared = 0
+        for item in value:
+            item_own, item_shared = value_bytes(item)
+            own += item_own
+            shared += item_shared
+        return own, shared
+
+    if isinstance(value, Font):
+        return value.text_cache.bytes, SurfaceCache.surface_bytes(value.image)
+
+    if isinstance(value, SpriteSheet):
+        own, shared = value_bytes(value.frames)
+        return value.effects.variants.bytes, own + shared
+
+    if pygame.mixer.get_init() and isinstance(value, pygame.mixer.Sound):
+        return sound_bytes(value), 0
+
+    return 0, 0
+
+
+def string_bytes(strings):
+    """Returns the bytes held by the strings of a :class:`StringStore <strings.StringStore>`:
+    those added at run time and those in the loaded pages of its string table."""
+    total = 0
+    for name, string in strings.added.items():
+        total += sys.getsizeof(name) + sys.getsizeof(string)
+
+    if strings.table is not None:
+        for page in strings.table.pages.values():
+            total += sum(sys.getsizeof(string) for string in page)
+
+    return total
+
+
+def account(game):
+    """Returns a list of ``(category, entries, own bytes, shared bytes)`` rows for every
+    ``Core.cache`` category, the current zone's map surface, and the script strings."""
+    categories = {}
+    for key, value in game.core.cache.items():
+        row = categories.setdefault(key[0], [0, 0, 0])
+        own, shared = value_bytes(value)
+        row[0] += 1
+        row[1] += own
+        row[2] += shared
+
+    rows = [(category, n, own, shared) for category, (n, own, shared) in sorted(categories.items())]
+
+    if game.zone is not None:
+        own, shared = surface_bytes(game.zone.map_surface)
+        rows.append(("zone map", 1, own, shared))
+
+    strings = game.core.script_api.strings
+    rows.append(("strings", len(strings.added), string_bytes(strings), 0))
+
+    return rows
+
+
+class MemoryTracker:
+    """This class produces the memory report shown by the debug key and by
+    ``--memory-report``. Once :meth:`start_tracking` is called, a snapshot of the Python
+    heap is taken at every zone transition and compared with the previous one.
+
+    The snapshots come from ``tracemalloc`` if it can be imported (it is not part of the
+    Python 2 standard library); otherwise they count the objects tracked by the garbage
+    collector by class, which is enough to see which kinds of object keep piling up."""
+    def __init__(self, top=10):
+        self.top = top
+
+        self.tracking = False
+        self.snapshot = None
+        self.zone = None
+        self.diffs = []
+
+    def start_tracking(self, zone=None):
+        """Starts snapshotting the heap at zone transitions, with a first snapshot now."""
+        if tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+        self.tracking = True
+        self.snapshot = self.take_snapshot()
+        self.zone = zone
+
+    def take_snapshot(self):
+        if tracemalloc is not None:
+            return tracemalloc.take_snapshot()
+
+        gc.collect()
+        return Counter(getattr(obj, "__class__", type(obj)).__name__ for obj in gc.get_objects())
+
+    def compare(self, old, new):
+        """Returns up to ``top`` lines describing the largest growth from ``old`` to ``new``."""
+        if tracemalloc is not None:
+            return [str(stat) for stat in new.compare_to(old, "lineno")[:self.top]]
+
+        growth = new - old
+        return ["{:>+8}  {}".format(count, name) for name, count in growth.most_common(self.top)]
+
+    def zone_entered(self, zone):
+        """Takes a snapshot and records how the heap changed since the previous zone.
+        Does nothing unless tracking has been started."""
+        if not self.tracking:
+            return
+
+        snapshot = self.take_snapshot()
+        self.diffs.append((self.zone, zone, self.compare(self.snapshot, snapshot)))
+        self.snapshot = snapshot
+        self.zone = zone
+
+    def report(self, game):
+        """Returns a multi-line string with the bytes held per category and the heap
+        growth across the most recent zone transition."""
+        rows = account(game)
+
+        lines = ["category          entries      own KB   shared KB"]
+        for category, n, own, shared in rows:
+            lines.append("{:<16} {:>8} {:>11.1f} {:>11.1f}".format(category, n, own / 1024.0, shared / 1024.0))
+        lines.append("{:<16} {:>8} {:>11.1f}".format("total", "", sum(row[2] for row in rows) / 1024.0))
+
+        if self.diffs:
+            old, new, diff = self.diffs[-1]
+            lines.append("")
+            lines.append("heap growth from zone {} to zone {} ({} transitions recorded):".format(old, new, len(self.diffs)))
+            lines.extend(diff or ["(none)"])
+
+        return "\n".join(lines)
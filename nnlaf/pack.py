@@ -0,0 +1,188 @@
+#!/usr/bin/env python2
+
+"""This module contains the asset pack format: :func:`write_pack` stores every data
+file in a single archive, and :class:`PackFile` memory-maps such an archive so
+:class:`Core <core.Core>` can load assets from it without walking the data
+directory or opening one file per asset.
+
+Run it directly to build the pack: ``python pack.py [--output PATH] [--verify]``.
+
+A pack is laid out as a header, an index of fixed-size entries sorted by basename,
+a blob of basenames, and then the file contents. Each entry holds the position of
+its name, the position and size of its contents and their CRC-32. Data scripts are
+not packed, so the level file (see :mod:`build`) should be built first."""
+
+import io
+import os
+import sys
+import mmap
+import zlib
+import struct
+import argparse
+
+PACK_MAGIC = "NNPK"
+PACK_VERSION = 1
+
+HEADER = struct.Struct("<4sHHII")
+ENTRY = struct.Struct("<IIQII")
+
+SKIPPED_EXTENSIONS = (".py", ".pyc")
+
+game_path = os.path.dirname(os.path.realpath(os.path.abspath(__file__)))
+data_path = os.path.join(game_path, 'data')
+pack_path = os.path.join(game_path, 'data.pack')
+
+
+class PackFormatError(Exception):
+    pass
+
+
+def crc(data):
+    return zlib.crc32(data) & 0xFFFFFFFF
+
+
+def write_pack(path, file_map):
+    """Writes every file in ``file_map``, which maps basenames to paths as made by
+    :func:`make_file_map <core.make_file_map>`, to a pack at ``path``."""
+    names = sorted(file_map)
+
+    name_blob = "".join(names)
+    data_at = HEADER.size + ENTRY.size * len(names) + len(name_blob)
+
+    entries = []
+    contents = []
+    name_offset = 0
+    offset = data_at
+    for name in names:
+        with open(file_map[name], "rb") as f:
+            data = f.read()
+        entries.append(ENTRY.pack(name_offset, len(name), offset, len(data), crc(data)))
+        contents.append(data)
+        name_offset += len(name)
+        offset += len(data)
+
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(PACK_MAGIC, PACK_VERSION, 0, len(names), len(name_blob)))
+        f.write("".join(entries))
+        f.write(name_blob)
+        for data in contents:
+            f.write(data)
+
+
+class PackFile:
+    """This class gives read access to a pack written by :func:`write_pack`. The pack is
+    memory-mapped and opening it only reads the header; files are found by a binary
+    search of the sorted index, and the entries found are remembered."""
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.data) < HEADER.size:
+            raise PackFormatError("Pack {} is truncated".format(path))
+
+        magic, version, reserved, self.count, names_size = HEADER.unpack_from(self.data)
+        if magic != PACK_MAGIC or version != PACK_VERSION:
+            raise PackFormatError("Pack {} has an unsupported format".format(path))
+
+        self.names_at = HEADER.size + ENTRY.size * self.count
+        if len(self.data) < self.names_at + names_size:
+            raise PackFormatError("Pack {} is truncated".format(path))
+
+        self.found = {}
+
+    def close(self):
+        self.data.close()
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, fn):
+        return self.entry(fn) is not None
+
+    def _entry_at(self, n):
+        name_offset, name_length, offset, size, checksum = ENTRY.unpack_from(self.data, HEADER.size + ENTRY.size * n)
+        start = self.names_at + name_offset
+        return self.data[start:start + name_length], offset, size, checksum
+
+    def names(self):
+        """Returns the basenames of every file in the pack, in sorted order."""
+        return [self._entry_at(n)[0] for n in xrange(self.count)]
+
+    def entry(self, fn):
+        """Returns ``(offset, size, crc)`` for the file named ``fn``, or ``None`` if the
+        pack does not contain it."""
+        if fn in self.found:
+            return self.found[fn]
+
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            name, offset, size, checksum = self._entry_at(mid)
+            if name < fn:
+                lo = mid + 1
+            elif name > fn:
+                hi = mid
+            else:
+                self.found[fn] = (offset, size, checksum)
+                return self.found[fn]
+
+        return None
+
+    def buffer(self, fn):
+        """Returns a read-only ``buffer`` over the contents of the file named ``fn``,
+        without copying them. Raises ``KeyError`` if there is no such file."""
+        entry = self.entry(fn)
+        if entry is None:
+            raise KeyError(fn)
+
+        offset, size, checksum = entry
+        return buffer(self.data, offset, size)
+
+    def read(self, fn):
+        """Returns the contents of the file named ``fn`` as a string."""
+        return self.buffer(fn)[:]
+
+    def open(self, fn):
+        """Returns a file object reading the contents of the file named ``fn``."""
+        return io.BytesIO(self.read(fn))
+
+    def verify(self, fn):
+        """Returns ``True`` if the contents of the file named ``fn`` match their CRC-32."""
+        offset, size, checksum = self.entry(fn)
+        return crc(self.buffer(fn)) == checksum
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pack the data directory into a single asset archive.")
+    parser.add_argument("--output", default=pack_path, help="pack to write (default: data.pack next to the data directory)")
+    parser.add_argument("--verify", action="store_true", help="check every file in the written pack against its CRC-32")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    from build import scan_data
+    from core import LEVEL_FILE
+
+    file_map, duplicates = scan_data(data_path)
+    for fn in sorted(duplicates):
+        print "PACK: duplicate basename {!r}: {}".format(fn, ", ".join(duplicates[fn]))
+
+    file_map = dict((fn, path) for fn, path in file_map.items() if not fn.endswith(SKIPPED_EXTENSIONS))
+    if LEVEL_FILE not in file_map:
+        print "PACK: no {} in the data directory; scripts are not packed, so build it first".format(LEVEL_FILE)
+
+    write_pack(args.output, file_map)
+    print "PACK: wrote {} ({} files, {} bytes)".format(args.output, len(file_map), os.path.getsize(args.output))
+
+    if args.verify:
+        pack = PackFile(args.output)
+        bad = [fn for fn in pack.names() if not pack.verify(fn)]
+        pack.close()
+        for fn in bad:
+            print "PACK: {} failed verification".format(fn)
+        if bad:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -21,7 +21,15 @@ class Player:
 
         #self.hurt_sound = self.game.core.get_sound("player_hurt.ogg")
 
+    def place(self, x, y):
+        """Moves the player to ``x``, ``y`` without drawing a frame that slides there from
+        the old position."""
+        self.body.place(x, y)
+        self.sprite.move_to(self.body)
+        self.sprite.save_prev()
+
     def update(self, ticks):
+        self.body.save_prev()
         self.body.update(ticks)
         self.sprite.update(ticks)
         self.status.update(ticks)
@@ -29,6 +37,10 @@ class Player:
         if self.stun > 0:
             self.stun = max(self.stun - 0.1, 0)
 
+    def draw(self, camera, alpha=1.0):
+        self.sprite.draw_self(camera, alpha)
+        self.status.draw_self(camera)
+
     def collect(self, pickup):
         if pickup.drop_type == "key":
             self.keys.append(pickup.config)
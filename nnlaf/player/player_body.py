@@ -41,8 +41,7 @@ class PlayerBody(Body):
         self.jump_start = -13.2
         self.jump_cut = -5
 
-        self.dash_sound = self.player.game.core.get_sound("player_dash.ogg")
-        self.jump_sound = self.player.game.core.get_sound("player_jump.ogg")
+        self.sound = self.player.game.sound
 
     def update_self(self, ticks):
         super(PlayerBody, self).update_self(ticks)
@@ -54,7 +53,7 @@ class PlayerBody(Body):
             if self.b_blocked or (self.dash_timer > 0 and not self.air_dash):
                 self.dash_timer = 0
                 self.y_vel = self.jump_start
-                self.jump_sound.play()
+                self.sound.play("player_jump.ogg", "player", priority=1)
         elif self.player.game.controller.just_released("jump"):
             if self.y_vel < self.jump_cut:
                 self.y_vel = self.jump_cut
@@ -67,11 +66,11 @@ class PlayerBody(Body):
         if self.player.game.controller.just_pressed("dash") and self.dash_timer <= 0:
             if self.b_blocked:
                 self.dash_timer = 30
-                self.dash_sound.play()
+                self.sound.play("player_dash.ogg", "player", priority=1)
             elif self.air_dash < 1:
                 self.dash_timer = 30
                 self.air_dash += 1
-                self.dash_sound.play()
+                self.sound.play("player_dash.ogg", "player", priority=1)
 
         if self.dash_timer <= 0:
             if self.player.game.controller.pressed("run_left") and ScG.controller.released("run_right"):
@@ -1,42 +1,70 @@
-import pygame
 from rect import Rect
+from animation_machine import AnimationMachine
 
 
-class Animation:
-    def __init__(self, frames, rate=6.0):
-        self.frames = frames
-        self.rate = rate
+PLAYER_ANIMATIONS = AnimationMachine(
+    ("stand_r", "run_r", "skid_r", "dash_r", "rise_r", "float_r", "fall_r",
+     "stand_l", "run_l", "skid_l", "dash_l", "rise_l", "float_l", "fall_l"),
+    (
+        (None, (("dash_timer", ">", 0), ("facing", "==", "right")), "dash_r"),
+        (None, (("dash_timer", ">", 0),), "dash_l"),
 
-    def frame_at_ticks(self, ticks):
-        return self.frames[int(((ticks // self.rate) % len(self.frames)))]
+        (None, (("b_blocked", "==", True), ("x_vel", ">", 0.5), ("x_dir", ">", 0)), "run_r"),
+        (None, (("b_blocked", "==", True), ("x_vel", ">", 0.5)), "skid_r"),
+        (None, (("b_blocked", "==", True), ("x_vel", "<", -0.5), ("x_dir", "<", 0)), "run_l"),
+        (None, (("b_blocked", "==", True), ("x_vel", "<", -0.5)), "skid_l"),
+        (None, (("b_blocked", "==", True), ("facing", "==", "right")), "stand_r"),
+        (None, (("b_blocked", "==", True),), "stand_l"),
+
+        (None, (("facing", "==", "right"), ("y_vel", "<", -2.0)), "rise_r"),
+        (None, (("facing", "==", "right"), ("y_vel", ">", 2.0)), "fall_r"),
+        (None, (("facing", "==", "right"),), "float_r"),
+        (None, (("y_vel", "<", -2.0),), "rise_l"),
+        (None, (("y_vel", ">", 2.0),), "fall_l"),
+        (None, (), "float_l"),
+    ),
+)
+
+
+FLASH = ("flash",)
 
 
 class Sprite(Rect):
-    def __init__(self, frames):
+    """This class draws the frames of a shared :class:`SpriteSheet
+    <sprite_sheet.SpriteSheet>`. While ``flashing`` is counting down the frame
+    alternates with a white silhouette every ``flash_period`` ticks; otherwise, if
+    ``effect`` is set, the frame is drawn with that effect (see :class:`EffectCache
+    <effects.EffectCache>`). Either way it is a single blit."""
+    def __init__(self, sheet):
         super(Sprite, self).__init__()
 
-        self.frames = frames
+        self.sheet = sheet
+        self.frames = sheet.frames
+        self.animations = sheet.animations
 
         self.size = self.frames[0].get_size()
 
         self.ticks = 0
-        self.animations = {}
         self.active_animation = None
         self.active_frame = None
 
         self.flashing = 0
+        self.flash_period = 2
+        self.effect = None
 
-        self.add_animation("default", 0)
         self.select_animation("default")
 
     def add_animation(self, name, start, length=1, rate=6):
-        self.animations[name] = Animation(self.frames[start:start + length], rate)
+        self.sheet.add_animation(name, start, length, rate)
 
     def select_animation(self, name):
-        if self.active_animation is not self.animations[name]:
+        self.set_animation(self.animations[name])
+
+    def set_animation(self, animation):
+        if self.active_animation is not animation:
             self.ticks = 0
-            self.active_animation = self.animations[name]
-            self.active_frame = self.active_animation.frame_at_ticks(self.ticks)
+            self.active_animation = animation
+            self.active_frame = animation.frame_at_ticks(self.ticks)
 
     def update(self, ticks):
         self.ticks += 1
@@ -44,26 +72,37 @@ class Sprite(Rect):
         if self.flashing > 0:
             self.flashing -= 1
 
-    def draw_self(self, camera):
-        if self.flashing == 0 or (self.flashing % 2) == 0:
-            camera.surface.blit(self.active_frame, (
-                self.x + ((self.w - self.active_frame.get_width()) // 2) - camera.sx,
-                self.y + ((self.h - self.active_frame.get_height()) // 2) - camera.sy,
-            ))
+    def current_effect(self):
+        if self.flashing > 0 and (self.flashing // self.flash_period) % 2:
+            return FLASH
+
+        return self.effect
+
+    def draw_self(self, camera, alpha=1.0):
+        frame = self.active_frame
+
+        effect = self.current_effect()
+        if effect is not None:
+            frame = self.sheet.effects.get(frame, effect)
+
+        x, y = self.lerp_pos(alpha)
+        camera.surface.blit(frame, (
+            int(x) + ((self.w - frame.get_width()) // 2) - camera.sx,
+            int(y) + ((self.h - frame.get_height()) // 2) - camera.sy,
+        ))
 
 
 class PlayerSprite(Sprite):
     def __init__(self, player):
         self.player = player
 
-        frames = list(self.player.game.core.get_tiles("player_anarchy_female.png", 8, 4))
-        for frame in frames[:]:
-            flip = pygame.transform.flip(frame, True, False)
-            frames.append(flip)
+        sheet = self.player.game.core.get_sheet("player_anarchy_female.png", 8, 4, mirrored=True)
 
-        Sprite.__init__(self, frames)
+        Sprite.__init__(self, sheet)
 
         self.size = self.player.size
+        self.move_to(self.player.body)
+        self.save_prev()
 
         self.add_animation("stand_r",  0, 1)
         self.add_animation("run_r",    1, 6)
@@ -80,47 +119,17 @@ class PlayerSprite(Sprite):
         self.add_animation("float_l", 49, 1)
         self.add_animation("fall_l",  50, 1)
 
+        self.state_animations = sheet.bind(PLAYER_ANIMATIONS)
+        self.anim_state = 0
+
         self.update_animation()
 
     def update(self, ticks):
+        self.save_prev()
         Sprite.update(self, ticks)
         self.move_to(self.player.body)
         self.update_animation()
 
     def update_animation(self):
-        if self.player.body.dash_timer > 0:
-            if self.player.body.facing == "right":
-                self.select_animation("dash_r")
-            else:
-                self.select_animation("dash_l")
-        elif self.player.body.b_blocked:
-            if self.player.body.x_vel > 0.5:
-                if self.player.body.x_dir > 0:
-                    self.select_animation("run_r")
-                else:
-                    self.select_animation("skid_r")
-            elif self.player.body.x_vel < -0.5:
-                if self.player.body.x_dir < 0:
-                    self.select_animation("run_l")
-                else:
-                    self.select_animation("skid_l")
-            else:
-                if self.player.body.facing == "right":
-                    self.select_animation("stand_r")
-                else:
-                    self.select_animation("stand_l")
-        else:
-            if self.player.body.facing == "right":
-                if self.player.body.y_vel < -2.0:
-                    self.select_animation("rise_r")
-                elif self.player.body.y_vel > 2.0:
-                    self.select_animation("fall_r")
-                else:
-                    self.select_animation("float_r")
-            else:
-                if self.player.body.y_vel < -2.0:
-                    self.select_animation("rise_l")
-                elif self.player.body.y_vel > 2.0:
-                    self.select_animation("fall_l")
-                else:
-                    self.select_animation("float_l")
+        self.anim_state = PLAYER_ANIMATIONS.step(self.anim_state, self.player.body)
+        self.set_animation(self.state_animations[self.anim_state])
@@ -21,6 +21,9 @@ class Rect(object):
         self.w = w
         self.h = h
 
+        self.prev_x = x
+        self.prev_y = y
+
     def __len__(self):
         return 4
 
@@ -199,6 +202,30 @@ class Rect(object):
         """Returns a new ``Rect`` with the same size and position as ``self``."""
         return Rect(*self)
 
+    def save_prev(self):
+        """Records the current position as the previous simulation state, for use
+        by :meth:`lerp_pos`. Moving objects should call this at the start of each
+        simulation step, before they move."""
+        self.prev_x = self.x
+        self.prev_y = self.y
+
+    def place(self, x, y):
+        """Moves to ``x``, ``y`` without interpolating from the old position, by also
+        recording it as the previous simulation state. Use this to spawn or teleport an
+        object that is drawn with :meth:`lerp_pos`."""
+        self.x = x
+        self.y = y
+        self.save_prev()
+
+    def lerp_pos(self, alpha):
+        """Returns the x,y position interpolated between the position recorded by
+        :meth:`save_prev` and the current position; ``alpha`` of ``0.0`` gives the
+        previous position and ``1.0`` gives the current one."""
+        return (
+            self.prev_x + (self.x - self.prev_x) * alpha,
+            self.prev_y + (self.y - self.prev_y) * alpha,
+        )
+
     def internal_coords(self, step=1):
         """Returns a list of coordinate pairs (tuples) inside this rectangle;
         starts at ``(self.x, self.y)`` and proceeds left-to-right/top-to-bottom,
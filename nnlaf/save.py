@@ -0,0 +1,478 @@
+"""This module contains the save format and the :class:`SaveManager` class, which
+saves the game without stalling a frame: the objects that changed are copied on
+the main thread, and a background thread compresses them and writes them.
+
+A save file is a sequence of frames. Each frame is a header followed by a
+zlib-compressed payload holding the current zone, the player's stats and keys,
+a list of world objects with their zone, position and size (and, for terrain, the
+``static`` flag and image file names), and a list of the objects that were
+removed. A *base* frame lists every object; the *delta* frames appended
+after it list only the objects that changed or were removed since the frame
+before. Every ``compact_every`` deltas the file is rewritten as a single base
+frame. A frame cut short by a crash is ignored, along
+with anything after it."""
+
+import os
+import time
+import zlib
+import Queue
+import struct
+import threading
+
+from timeit import default_timer
+
+from world_model import KINDS
+
+SAVE_MAGIC = "NNSV"
+SAVE_VERSION = 3
+
+FRAME = struct.Struct("<4sHBBIII")
+PLAYER = struct.Struct("<ddd")
+OBJECT = struct.Struct("<BBddddB")
+REMOVED = struct.Struct("<BB")
+COUNT = struct.Struct("<I")
+LENGTH = struct.Struct("<H")
+FLAG = struct.Struct("<B")
+
+BASE = 0
+DELTA = 1
+
+ID_STR = 0
+ID_INT = 1
+
+NO_STATIC = 2
+
+
+class SaveFormatError(Exception):
+    pass
+
+
+def snapshot(game, full=False):
+    """Returns the state of ``game`` to be saved, as ``(zone, player, objects, removed)``.
+    ``player`` is ``(health, damage, stun, keys)``, or ``None`` if there is no player;
+    ``objects`` maps ``(kind, id)`` to ``(home zone, zone, x, y, w, h, static, images)``
+    and ``removed`` maps ``(kind, id)`` to the home zone of a removed object. ``static``
+    and ``images`` (a tuple of image file names) are ``None`` for objects other than
+    terrain; images not loaded through ``Core.get_image`` have no name and are left out.
+
+    Only the objects the world registry reports as changed or removed since the previous
+    snapshot are included, so the cost grows with what changed rather than with the size
+    of the world. If ``full`` is ``True`` every object is included instead, which is
+    only meant for load time."""
+    zone = game.zone.zone if game.zone is not None else None
+
+    player = getattr(game, "player", None)
+    if player is not None:
+        player = (player.health, player.damage, player.stun, tuple(player.keys))
+
+    world = game.core.script_api.world
+    dirty, removed = world.take_changes()
+    if full:
+        dirty = {}
+        for kind, store in world.by_id.iteritems():
+            for obj_id, obj in store.iteritems():
+                dirty[(kind, obj_id)] = obj
+
+    image_names = game.core.image_names
+    objects = {}
+    for key, obj in dirty.iteritems():
+        images = getattr(obj, "images", None)
+        if images is not None:
+            images = tuple(image_names[image] for image in images if image in image_names)
+        objects[key] = (obj.home_zone, obj.zone, obj.x, obj.y, obj.w, obj.h, getattr(obj, "static", None), images)
+
+    return zone, player, objects, removed
+
+
+def session_path(path):
+    """Returns ``path`` if there is no file there yet, or else a path next to it with the
+    current date and time added to the name, so that a new game does not replace an
+    existing save."""
+    if not os.path.exists(path):
+        return path
+
+    base, ext = os.path.splitext(path)
+    return "{}-{}{}".format(base, time.strftime("%Y%m%d-%H%M%S"), ext)
+
+
+def apply_changes(objects, removed, changed, gone):
+    """Updates ``objects`` and ``removed``, in the form returned by :func:`snapshot`, with
+    the objects in ``changed`` and the removals in ``gone``."""
+    objects.update(changed)
+    for key in changed:
+        removed.pop(key, None)
+    for key in gone:
+        objects.pop(key, None)
+    removed.update(gone)
+
+
+def _string(s):
+    if s is None:
+        return FLAG.pack(0)
+    if isinstance(s, unicode):
+        s = s.encode("utf-8")
+    if len(s) > 0xFFFF:
+        raise ValueError("String of {} bytes is too long to save".format(len(s)))
+    return FLAG.pack(1) + LENGTH.pack(len(s)) + s
+
+
+def _read_string(data, pos):
+    present, = FLAG.unpack_from(data, pos)
+    pos += FLAG.size
+    if not present:
+        return None, pos
+    length, = LENGTH.unpack_from(data, pos)
+    pos += LENGTH.size
+    return data[pos:pos + length], pos + length
+
+
+def _id(obj_id):
+    if isinstance(obj_id, (int, long)):
+        return ID_INT, str(obj_id)
+    return ID_STR, obj_id
+
+
+def _number(v):
+    return int(v) if v.is_integer() else v
+
+
+def encode(zone, player, objects, removed):
+    """Returns the uncompressed payload for a frame holding ``zone``, ``player``,
+    ``objects`` and ``removed``, in the form returned by :func:`snapshot`."""
+    parts = [_string(zone)]
+
+    if player is None:
+        parts.append(FLAG.pack(0))
+    else:
+        health, damage, stun, keys = player
+        parts.append(FLAG.pack(1))
+        parts.append(PLAYER.pack(health, damage, stun))
+        parts.append(COUNT.pack(len(keys)))
+        parts.extend(_string(key) for key in keys)
+
+    parts.append(COUNT.pack(len(objects)))
+    for (kind, obj_id), (home, obj_zone, x, y, w, h, static, images) in objects.iteritems():
+        id_type, obj_id = _id(obj_id)
+        parts.append(OBJECT.pack(KINDS.index(kind), id_type, x, y, w, h, NO_STATIC if static is None else bool(static)))
+        parts.append(_string(obj_id))
+        parts.append(_string(home))
+        parts.append(_string(obj_zone))
+        if images is None:
+            parts.append(FLAG.pack(0))
+        else:
+            parts.append(FLAG.pack(1))
+            parts.append(COUNT.pack(len(images)))
+            parts.extend(_string(image) for image in images)
+
+    parts.append(COUNT.pack(len(removed)))
+    for (kind, obj_id), home in removed.iteritems():
+        id_type, obj_id = _id(obj_id)
+        parts.append(REMOVED.pack(KINDS.index(kind), id_type))
+        parts.append(_string(obj_id))
+        parts.append(_string(home))
+
+    return "".join(parts)
+
+
+def decode(data):
+    """Reads a payload written by :func:`encode`; returns ``(zone, player, objects, removed)``."""
+    zone, pos = _read_string(data, 0)
+
+    has_player, = FLAG.unpack_from(data, pos)
+    pos += FLAG.size
+    player = None
+    if has_player:
+        health, damage, stun = [_number(v) for v in PLAYER.unpack_from(data, pos)]
+        pos += PLAYER.size
+        key_count, = COUNT.unpack_from(data, pos)
+        pos += COUNT.size
+        keys = []
+        for n in xrange(key_count):
+            key, pos = _read_string(data, pos)
+            keys.append(key)
+        player = (health, damage, stun, tuple(keys))
+
+    count, = COUNT.unpack_from(data, pos)
+    pos += COUNT.size
+    objects = {}
+    for n in xrange(count):
+        kind_n, id_type, x, y, w, h, static = OBJECT.unpack_from(data, pos)
+        pos += OBJECT.size
+        obj_id, pos = _read_string(data, pos)
+        home, pos = _read_string(data, pos)
+        obj_zone, pos = _read_string(data, pos)
+        if id_type == ID_INT:
+            obj_id = int(obj_id)
+
+        has_images, = FLAG.unpack_from(data, pos)
+        pos += FLAG.size
+        images = None
+        if has_images:
+            image_count, = COUNT.unpack_from(data, pos)
+            pos += COUNT.size
+            images = []
+            for i in xrange(image_count):
+                image, pos = _read_string(data, pos)
+                images.append(image)
+            images = tuple(images)
+
+        objects[(KINDS[kind_n], obj_id)] = (
+            home, obj_zone, _number(x), _number(y), _number(w), _number(h),
+            None if static == NO_STATIC else bool(static), images,
+        )
+
+    count, = COUNT.unpack_from(data, pos)
+    pos += COUNT.size
+    removed = {}
+    for n in xrange(count):
+        kind_n, id_type = REMOVED.unpack_from(data, pos)
+        pos += REMOVED.size
+        obj_id, pos = _read_string(data, pos)
+        home, pos = _read_string(data, pos)
+        if id_type == ID_INT:
+            obj_id = int(obj_id)
+        removed[(KINDS[kind_n], obj_id)] = home
+
+    return zone, player, objects, removed
+
+
+def frame(kind, seq, payload, level=6):
+    """Returns a complete frame of ``kind`` (``BASE`` or ``DELTA``) holding ``payload``."""
+    data = zlib.compress(payload, level)
+    return FRAME.pack(SAVE_MAGIC, SAVE_VERSION, kind, 0, seq, len(data), zlib.crc32(data) & 0xFFFFFFFF) + data
+
+
+def read_save(path):
+    """Reads the save file at ``path`` and returns ``(state, frames)``: the state from its
+    base frame with every intact delta applied, in the form returned by :func:`snapshot`,
+    and the number of frames read. Returns ``(None, 0)`` if there is no save, and raises
+    :class:`SaveFormatError` if the file is not a save in this format."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except IOError:
+        return None, 0
+
+    state = None
+    frames = 0
+    pos = 0
+    while pos + FRAME.size <= len(data):
+        magic, version, kind, reserved, seq, size, checksum = FRAME.unpack_from(data, pos)
+        if magic != SAVE_MAGIC or version != SAVE_VERSION:
+            raise SaveFormatError("Save file {} has an unsupported format".format(path))
+
+        body = data[pos + FRAME.size:pos + FRAME.size + size]
+        if len(body) != size or zlib.crc32(body) & 0xFFFFFFFF != checksum:
+            print "SAVE: Ignoring damaged frame {} in {}".format(seq, path)
+            break
+        pos += FRAME.size + size
+
+        zone, player, objects, removed = decode(zlib.decompress(body))
+        if kind == BASE or state is None:
+            state = (zone, player, objects, removed)
+        else:
+            apply_changes(state[2], state[3], objects, removed)
+            state = (zone, player, state[2], state[3])
+        frames += 1
+
+    return state, frames
+
+
+class SaveManager:
+    """This class saves the game to the file at ``path``. :meth:`save` takes a
+    :func:`snapshot` of what changed on the calling thread and hands it to a writer
+    thread, which drops anything that matches what it wrote last, appends a delta frame
+    holding the rest, and ``fsync``\\ s the file. Snapshots that arrive while the writer
+    is busy are merged, so only one frame is written for them.
+
+    A new manager starts a new save: the first frame it writes is a base frame that
+    replaces whatever was at ``path``. Call :meth:`load` first to carry on from it
+    instead, or use :func:`session_path` to leave an existing save alone. Call
+    :meth:`begin` at load time, after :meth:`load`, so the base frame does not have to
+    be gathered on the main thread during play.
+
+    ``last_snapshot_ms`` is the time the most recent :meth:`save` spent on the calling
+    thread; ``last_write_ms`` and ``bytes_written`` describe the writer's work."""
+    def __init__(self, path, compact_every=32, level=6):
+        self.path = path
+        self.compact_every = compact_every
+        self.level = level
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.written = (None, None, {}, {})
+        self.begun = False
+
+        # The first write of a session is a base frame, so deltas are never appended
+        # after a damaged frame left by a crash, or to a save from another game.
+        self.deltas = compact_every
+        self.seq = 0
+
+        self.saves = 0
+        self.frames_written = 0
+        self.bytes_written = 0
+        self.last_snapshot_ms = None
+        self.last_write_ms = None
+
+        self.queue = Queue.Queue()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def begin(self, game):
+        """Takes a full snapshot of ``game`` as the state the first base frame will hold, so
+        that every :meth:`save` only has to copy what changed. This reads every object in
+        the world, so call it at load time rather than between frames; :meth:`save` calls
+        it if it has not been called."""
+        zone, player, objects, removed = snapshot(game, full=True)
+        apply_changes(self.written[2], self.written[3], objects, removed)
+        self.written = (zone, player, self.written[2], self.written[3])
+        self.begun = True
+
+    def save(self, game):
+        """Queues the changes to ``game`` since the previous save to be written in the
+        background."""
+        if not self.begun:
+            self.begin(game)
+
+        start = default_timer()
+        self.queue.put(snapshot(game))
+        self.last_snapshot_ms = (default_timer() - start) * 1000.0
+        self.saves += 1
+
+    def load(self, game):
+        """Reads the file at ``path`` and restores its state into ``game``. Objects from a
+        level file whose home zone has not been loaded yet are loaded first, and objects
+        the save records as removed are removed. Call this before :meth:`begin`.
+        Returns ``False`` if there was nothing to restore; raises :class:`SaveFormatError`
+        if the file is not a save in this format."""
+        state, frames = read_save(self.path)
+        if state is None:
+            return False
+
+        self.written = state
+        zone, player, objects, removed = state
+
+        api = game.core.script_api
+        for (kind, obj_id), (home, obj_zone, x, y, w, h, static, images) in objects.iteritems():
+            obj = self._find(api, kind, obj_id, home)
+            if obj is None:
+                continue
+            obj.x, obj.y, obj.w, obj.h = x, y, w, h
+            obj.zone = obj_zone
+            if static is not None:
+                obj.static = static
+            if images is not None:
+                obj.images = [game.core.get_image(fn) for fn in images]
+
+        for (kind, obj_id), home in removed.iteritems():
+            obj = self._find(api, kind, obj_id, home)
+            if obj is not None:
+                api.world.remove(obj)
+
+        if player is not None and getattr(game, "player", None) is not None:
+            game.player.health, game.player.damage, game.player.stun, keys = player
+            game.player.keys = list(keys)
+
+        if zone is not None:
+            game.enter_zone(zone)
+
+        return True
+
+    @staticmethod
+    def _find(api, kind, obj_id, home):
+        obj = api.world.get(kind, obj_id)
+        if obj is None and api.level is not None and home is not None and home not in api.loaded_zones:
+            api.load_zone(home)
+            obj = api.world.get(kind, obj_id)
+        return obj
+
+    def close(self):
+        """Writes any queued snapshot and stops the writer thread."""
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        running = True
+        while running:
+            state = self.queue.get()
+            if state is None:
+                return
+
+            while True:
+                try:
+                    newer = self.queue.get_nowait()
+                except Queue.Empty:
+                    break
+                if newer is None:
+                    running = False
+                    break
+                apply_changes(state[2], state[3], newer[2], newer[3])
+                state = (newer[0], newer[1], state[2], state[3])
+
+            try:
+                self._write(state)
+            except Exception as e:
+                print "SAVE: Failed to write {}: {}: {}".format(self.path, type(e).__name__, e)
+                # What was not written is already in self.written, so a base frame
+                # written next time puts the file right.
+                self.deltas = self.compact_every
+
+    def _write(self, state):
+        start = default_timer()
+        zone, player, objects, removed = state
+        old_zone, old_player, old_objects, old_removed = self.written
+
+        changed = {}
+        for key, value in objects.iteritems():
+            if old_objects.get(key) != value:
+                changed[key] = value
+
+        gone = {}
+        for key, home in removed.iteritems():
+            if key in old_objects or key not in old_removed:
+                gone[key] = home
+
+        apply_changes(old_objects, old_removed, changed, gone)
+        self.written = (zone, player, old_objects, old_removed)
+
+        if self.deltas >= self.compact_every:
+            self._write_base(self.written, start)
+            return
+
+        if not changed and not gone and (zone, player) == (old_zone, old_player):
+            return
+
+        data = frame(DELTA, self.seq, encode(zone, player, changed, gone), self.level)
+        with open(self.path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.deltas += 1
+        self._wrote(data, start)
+
+    def _write_base(self, state, start):
+        self.seq = 0
+        data = frame(BASE, self.seq, encode(*state), self.level)
+
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        if os.name == "nt" and os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(temp_path, self.path)
+
+        self.deltas = 0
+        self._wrote(data, start)
+
+    def _wrote(self, data, start):
+        self.seq += 1
+        self.frames_written += 1
+        self.bytes_written += len(data)
+        self.last_write_ms = (default_timer() - start) * 1000.0
@@ -1,4 +1,7 @@
-from world_model import Battle, Target, Terrain
+from itertools import izip, repeat
+
+from strings import StringStore
+from world_model import Battle, Target, Terrain, WorldRegistry
 
 
 class ScriptAPI:
@@ -15,33 +18,177 @@ class ScriptAPI:
 
         self.cache = {}
 
-        self.battles = {}
-        self.targets = {}
-        self.terrain = {}
+        self.strings = StringStore(core.file_map)
+
+        self.world = WorldRegistry()
+
+        self.battles = self.world.by_id["battles"]
+        self.targets = self.world.by_id["targets"]
+        self.terrain = self.world.by_id["terrain"]
+
+        self.level = None
+        self.loaded_zones = set()
 
     def select_battle(self, battle_id):
         if battle_id not in self.battles:
-            self.battles[battle_id] = Battle()
+            self.world.add(battle_id, Battle())
 
         return self.battles[battle_id]
 
     def select_target(self, target_id):
         if target_id not in self.targets:
-            self.targets[target_id] = Target()
+            self.world.add(target_id, Target())
 
         return self.targets[target_id]
 
     def select_terrain(self, terrain_id):
         if terrain_id not in self.terrain:
-            self.terrain[terrain_id] = Terrain()
+            self.world.add(terrain_id, Terrain())
 
         return self.terrain[terrain_id]
 
-    def add_string(self, name, string):
-        key = ("string", name)
+    def define_battles(self, ids, rects, zones=None):
+        """Creates or updates many battles in one call; see :meth:`define_terrain`."""
+        return self._define("battles", Battle, ids, rects, zones)
+
+    def define_targets(self, ids, rects, zones=None):
+        """Creates or updates many targets in one call; see :meth:`define_terrain`."""
+        return self._define("targets", Target, ids, rects, zones)
+
+    def define_terrain(self, ids, rects, zones=None, images=None, static=None):
+        """Creates or updates many terrain objects in one call. The arguments are parallel
+        iterables with one entry per object: ``ids``, ``rects`` as ``(x, y, w, h)`` and
+        optionally ``zones``, ``images`` (an image file name per object, replacing any
+        images it had, or ``None`` for no image) and
+        ``static`` flags. ``rects`` or any of the optional arguments may instead be a single
+        value that applies to every object; a single rect is told apart from a column of
+        rects by its entries being numbers. ``ValueError`` is raised if the columns differ
+        in length.
+        Each image file is loaded once no matter how many objects use it. Returns the list
+        of objects, in the same order as ``ids``.
+
+        The objects are placed in the zone index of :attr:`world` as they are created, so the
+        contents of a zone can be found without searching every object; see :meth:`zone_objects`."""
+        objects = self._define("terrain", Terrain, ids, rects, zones)
+
+        if images is not None:
+            loaded = {}
+            get_image = self._core.get_image
+            for obj, fn in izip(objects, self._column(images, len(objects), "images")):
+                if fn is None:
+                    obj.images = []
+                    continue
+                image = loaded.get(fn)
+                if image is None:
+                    image = loaded[fn] = get_image(fn)
+                obj.images = [image]
+
+        if static is not None:
+            for obj, flag in izip(objects, self._column(static, len(objects), "static flags")):
+                obj.static = flag
+
+        return objects
+
+    def define_table(self, kind, rows):
+        """Like the ``define_*`` methods, but takes a table: a sequence of ``dict`` rows with
+        the keys ``"id"``, ``"rect"`` and optionally ``"zone"`` (and, for terrain, ``"image"``
+        and ``"static"``). ``kind`` is ``"battles"``, ``"targets"`` or ``"terrain"``."""
+        ids = [row["id"] for row in rows]
+        rects = [row["rect"] for row in rows]
+        zones = [row.get("zone") for row in rows]
+
+        if kind == "battles":
+            return self.define_battles(ids, rects, zones)
+        elif kind == "targets":
+            return self.define_targets(ids, rects, zones)
+        elif kind == "terrain":
+            images = [row.get("image") for row in rows]
+            static = [row.get("static", True) for row in rows]
+            return self.define_terrain(ids, rects, zones, images, static)
+        else:
+            raise ValueError("Unknown world object kind: {}".format(kind))
+
+    def zone_objects(self, zone, kind):
+        """Returns the list of ``kind`` objects (``"battles"``, ``"targets"`` or ``"terrain"``)
+        in ``zone``; see :meth:`WorldRegistry.in_zone <world_model.WorldRegistry.in_zone>`. If a
+        level file is attached, its objects are built the first time their zone is asked for."""
+        if self.level is not None and zone not in self.loaded_zones:
+            self.load_zone(zone)
+
+        return self.world.in_zone(zone, kind)
+
+    def attach_level(self, level):
+        """Uses ``level``, a :class:`LevelFile <level.LevelFile>`, as the source of world objects
+        and strings not defined by scripts."""
+        self.level = level
+        self.loaded_zones = set()
 
-        self.cache[key] = string
+    def load_zone(self, zone):
+        """Builds the objects of ``zone`` from the attached level file and adds them to the
+        world, unless that zone has already been loaded."""
+        self.loaded_zones.add(zone)
+
+        for kind, obj_id, obj in self.level.load_zone(zone, self._core.get_image):
+            if self.world.get(kind, obj_id) is None:
+                self.world.add(obj_id, obj)
+
+    @staticmethod
+    def _column(values, count, name, sequence_items=False):
+        """Returns ``values`` as a sequence of ``count`` entries. A string, or anything that is
+        not iterable, is a single value repeated for every entry; any other iterable is a
+        column with one entry per object, and ``ValueError`` is raised if it has a different
+        number of entries.
+
+        If ``sequence_items`` is true, each entry is itself a sequence (such as a rect), so an
+        iterable counts as a column only if its first entry is iterable too: ``(0, 0, 8, 8)``
+        is one rect for every object, while ``[(0, 0, 8, 8)]`` is a column of one rect."""
+        if isinstance(values, basestring) or not hasattr(values, "__iter__"):
+            return repeat(values, count)
+        if not hasattr(values, "__len__"):
+            values = list(values)
+        if sequence_items and len(values) > 0 and not hasattr(values[0], "__iter__"):
+            return repeat(values, count)
+        if len(values) != count:
+            raise ValueError("Expected {} {}, got {}".format(count, name, len(values)))
+        return values
+
+    def _define(self, kind, cls, ids, rects, zones):
+        store = self.world.by_id[kind]
+        add = self.world.add
+
+        if not hasattr(ids, "__len__"):
+            ids = list(ids)
+        rects = self._column(rects, len(ids), "rects", sequence_items=True)
+        zones = self._column(zones, len(ids), "zones")
+
+        objects = []
+        for obj_id, rect, zone in izip(ids, rects, zones):
+            obj = store.get(obj_id)
+            if obj is None:
+                obj = add(obj_id, cls())
+
+            obj.x, obj.y, obj.w, obj.h = rect
+            obj.zone = zone
+
+            objects.append(obj)
+
+        return objects
+
+    def add_string(self, name, string):
+        self.strings.add(name, string)
 
     def get_string(self, name):
-        key = ("string", name)
-        return self.cache.get(key, "[DEFAULT STRING]")
+        string = self.strings.get(name)
+
+        if string is None and self.level is not None:
+            string = self.level.get_string(name)
+
+        if string is None:
+            return "[DEFAULT STRING]"
+
+        return string
+
+    def set_locale(self, locale):
+        """Switches the strings returned by :meth:`get_string` to those of ``locale``; see
+        :class:`StringStore <strings.StringStore>`. Scripts do not need to be run again."""
+        self.strings.set_locale(locale)
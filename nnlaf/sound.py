@@ -0,0 +1,288 @@
+"""This module contains the :class:`SoundManager` class, which decides which sound
+effects actually get mixed, and the :class:`MusicPlayer` class, which switches
+music tracks without blocking the game loop."""
+
+import io
+import math
+import threading
+import pygame
+
+from timeit import default_timer
+
+from startup import ensure_mixer
+
+DEFAULT_GROUPS = (
+    ("music", 2),
+    ("ui", 2),
+    ("player", 4),
+    ("effects", 10),
+)
+
+
+class SoundManager:
+    """This class plays sound effects loaded by :class:`Core <core.Core>` on a fixed
+    pool of mixer channels, divided into named groups so that, for example, menu
+    sounds can never be crowded out by explosions. ``groups`` is a sequence of
+    ``(name, channel count)`` pairs; those channels are reserved so pygame never
+    hands them out on its own. The ``"music"`` group is meant for a
+    :class:`MusicPlayer` and should not be used for effects.
+
+    A play request can be refused for three reasons, each with its own counter:
+
+    *   **culled**: the sound is further than ``max_distance`` from the listener.
+    *   **capped**: ``max_voices`` copies of the same sound are already playing.
+    *   **dropped**: the group is full and every voice in it has a priority equal
+        to or higher than the new sound.
+
+    Otherwise, if the group is full, the lowest-priority voice in it (the oldest
+    one, among equals) is **stolen**: stopped and replaced by the new sound.
+
+    The mixer is not started, and no channels are reserved, until :attr:`groups` is
+    first used, which :meth:`play` does."""
+    def __init__(self, core, groups=DEFAULT_GROUPS, max_voices=2, max_distance=640.0):
+        self.core = core
+        self.max_voices = max_voices
+        self.max_distance = max_distance
+
+        self.group_sizes = groups
+        self._groups = None
+
+        self.voices = {}
+        self.serial = 0
+
+        self.caps = {}
+
+        self.plays = 0
+        self.culled = 0
+        self.capped = 0
+        self.dropped = 0
+        self.stolen = 0
+
+    @property
+    def groups(self):
+        """A ``dict`` of the ``pygame.mixer.Channel`` lists of each group, by name. The
+        first use starts the mixer and reserves the channels."""
+        if self._groups is None:
+            ensure_mixer()
+
+            total = sum(count for name, count in self.group_sizes)
+            if pygame.mixer.get_num_channels() < total:
+                pygame.mixer.set_num_channels(total)
+            pygame.mixer.set_reserved(total)
+
+            self._groups = {}
+            n = 0
+            for name, count in self.group_sizes:
+                self._groups[name] = [pygame.mixer.Channel(i) for i in xrange(n, n + count)]
+                n += count
+
+        return self._groups
+
+    def set_cap(self, fn, max_voices):
+        """Allows at most ``max_voices`` copies of the sound named ``fn`` at once."""
+        self.caps[fn] = max_voices
+
+    def _reap(self):
+        for channel, voice in self.voices.items():
+            if not channel.get_busy() or channel.get_sound() is not voice[1]:
+                del self.voices[channel]
+
+    @property
+    def active_voices(self):
+        """The number of sounds currently playing through this manager."""
+        self._reap()
+        return len(self.voices)
+
+    def play(self, fn, group="effects", priority=0, pos=None, listener=None, volume=1.0):
+        """Plays the sound named ``fn`` on a channel from ``group``. Higher ``priority``
+        voices steal channels from lower ones. If ``pos`` and ``listener`` are both given
+        as ``(x, y)`` pairs, the sound is culled beyond ``max_distance`` and its volume
+        falls off linearly with distance. Returns the ``pygame.mixer.Channel`` used, or
+        ``None`` if the sound was not played."""
+        if pos is not None and listener is not None:
+            distance = math.hypot(pos[0] - listener[0], pos[1] - listener[1])
+            if distance > self.max_distance:
+                self.culled += 1
+                return None
+            volume *= 1.0 - (distance / self.max_distance)
+
+        self._reap()
+
+        sound = self.core.get_sound(fn)
+
+        same = 0
+        for voice in self.voices.itervalues():
+            if voice[0] == fn:
+                same += 1
+        if same >= self.caps.get(fn, self.max_voices):
+            self.capped += 1
+            return None
+
+        channel = None
+        victim = None
+        for candidate in self.groups[group]:
+            voice = self.voices.get(candidate)
+            if voice is None:
+                channel = candidate
+                break
+            if voice[2] < priority and (victim is None or voice[2:] < self.voices[victim][2:]):
+                victim = candidate
+
+        if channel is None:
+            if victim is None:
+                self.dropped += 1
+                return None
+            victim.stop()
+            self.stolen += 1
+            channel = victim
+
+        channel.play(sound)
+        channel.set_volume(volume)
+
+        self.serial += 1
+        self.voices[channel] = (fn, sound, priority, self.serial)
+        self.plays += 1
+
+        return channel
+
+    def stats(self):
+        """Returns a ``dict`` of the voice counters."""
+        return {
+            "active": self.active_voices,
+            "plays": self.plays,
+            "culled": self.culled,
+            "capped": self.capped,
+            "dropped": self.dropped,
+            "stolen": self.stolen,
+        }
+
+
+class MusicPlayer:
+    """This class plays looping music on the two channels of the ``group`` of a
+    :class:`SoundManager`, so that one track can crossfade into the next over
+    ``fade_ms`` milliseconds.
+
+    Tracks are read and decoded by a background thread; :meth:`preload` starts that
+    early, for example when the player approaches a zone transition. :meth:`play`
+    never waits for a track to load: if it is not ready yet, the switch happens in
+    the first :meth:`update` after it is. The time the switch itself took on the main
+    thread is kept in ``last_stall_ms``, and printed if ``verbose`` is set.
+
+    Unlike ``pygame.mixer.music``, which streams from the file, each track is held fully
+    decoded in memory: about 10 MB per minute of 44.1 kHz 16-bit stereo, and two tracks
+    during a crossfade. Whenever the playing or pending track changes, every other
+    loaded track is released, including preloaded tracks that were never played."""
+    def __init__(self, core, sound, group="music", fade_ms=1000, volume=0.5, verbose=False):
+        self.core = core
+        self.sound = sound
+        self.group = group
+        self.fade_ms = fade_ms
+        self.volume = volume
+        self.verbose = verbose
+
+        self.lock = threading.Lock()
+        self.loaded = {}
+        self.loading = set()
+        self.failed = set()
+
+        self.current = None
+        self.pending = None
+        self.active = 0
+
+        self.last_stall_ms = None
+
+    @property
+    def channels(self):
+        """The two channels of the ``group`` of the :class:`SoundManager` ``sound``."""
+        return self.sound.groups[self.group]
+
+    def preload(self, fn):
+        """Starts loading the music file named ``fn`` in the background, unless it is already
+        loaded or loading. The mixer is started first if it is not running yet."""
+        ensure_mixer()
+
+        with self.lock:
+            if fn in self.loaded or fn in self.loading:
+                return
+            self.loading.add(fn)
+            self.failed.discard(fn)
+
+        thread = threading.Thread(target=self._load, args=(fn,))
+        thread.daemon = True
+        thread.start()
+
+    def _load(self, fn):
+        try:
+            data = self.core.read_file(fn)
+            sound = pygame.mixer.Sound(io.BytesIO(data))
+        except (IOError, KeyError, pygame.error) as e:
+            print "MUSIC: Failed to load {}: {}".format(fn, e)
+            sound = None
+
+        with self.lock:
+            self.loading.discard(fn)
+            if sound is not None:
+                self.loaded[fn] = sound
+            else:
+                self.failed.add(fn)
+
+    def play(self, fn):
+        """Switches to the music file named ``fn``, crossfading from the current track, as
+        soon as it is loaded. If ``fn`` is already playing, it keeps playing and any pending
+        switch is cancelled."""
+        if fn == self.current:
+            self.pending = None
+            return
+
+        self.pending = fn
+        self._evict()
+        self.preload(fn)
+        self.update()
+
+    def stop(self):
+        """Fades out whatever music is playing and releases its track. The next track
+        played starts on the other channel, so the fade is not cut short."""
+        self.pending = None
+        if self.current is not None:
+            self.channels[self.active].fadeout(self.fade_ms)
+            self.active = 1 - self.active
+            self.current = None
+        self._evict()
+
+    def _evict(self):
+        with self.lock:
+            for fn in self.loaded.keys():
+                if fn != self.current and fn != self.pending:
+                    del self.loaded[fn]
+
+    def update(self):
+        """Performs a pending switch if its track has finished loading, or drops it if the
+        track failed to load. Call once per frame."""
+        if self.pending is None:
+            return
+
+        with self.lock:
+            sound = self.loaded.get(self.pending)
+            failed = self.pending in self.failed
+        if failed:
+            self.pending = None
+        if sound is None:
+            return
+
+        start = default_timer()
+
+        if self.current is not None:
+            self.channels[self.active].fadeout(self.fade_ms)
+            self.active = 1 - self.active
+
+        channel = self.channels[self.active]
+        channel.set_volume(self.volume)
+        channel.play(sound, loops=-1, fade_ms=self.fade_ms)
+
+        self.current = self.pending
+        self.pending = None
+        self._evict()
+
+        self.last_stall_ms = (default_timer() - start) * 1000.0
+        if self.verbose:
+            print "MUSIC: Switched to {} (stalled {:.2f} ms)".format(self.current, self.last_stall_ms)
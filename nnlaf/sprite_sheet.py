@@ -0,0 +1,51 @@
+"""This module contains the :class:`SpriteSheet` and :class:`Animation` classes, which
+hold the parts of a sprite that every actor drawn from the same image can share."""
+
+from effects import EffectCache
+
+
+class Animation:
+    def __init__(self, frames, rate=6.0):
+        self.frames = frames
+        self.rate = rate
+
+    def frame_at_ticks(self, ticks):
+        return self.frames[int(((ticks // self.rate) % len(self.frames)))]
+
+
+class SpriteSheet:
+    """This class holds the frames of one sprite sheet and the :class:`Animation` objects
+    built from them. Sheets are created and cached by
+    :meth:`Core.get_sheet <core.Core.get_sheet>`, so the frames, the mirrored frames and
+    the animations are built once no matter how many sprites use the sheet; each
+    :class:`Sprite <player.player_sprite.Sprite>` only keeps its own playback state.
+
+    ``frames`` holds the tiles in reading order; if the sheet is mirrored, the
+    horizontally flipped tiles follow, in the same order. ``effects`` is an
+    :class:`EffectCache <effects.EffectCache>` holding the flashed, tinted and outlined
+    versions of the frames."""
+    def __init__(self, frames):
+        self.frames = frames
+        self.animations = {}
+        self.bound = {}
+        self.effects = EffectCache()
+
+        self.add_animation("default", 0)
+
+    def add_animation(self, name, start, length=1, rate=6):
+        """Defines the animation ``name`` as ``length`` frames from ``start``. Animations
+        belong to the sheet, so defining one that already exists does nothing."""
+        if name not in self.animations:
+            self.animations[name] = Animation(self.frames[start:start + length], rate)
+
+        return self.animations[name]
+
+    def bind(self, machine):
+        """Returns a list of this sheet's animations indexed by the state numbers of
+        ``machine``, an :class:`AnimationMachine <animation_machine.AnimationMachine>` whose
+        state names are animation names. The list is built once per machine."""
+        bound = self.bound.get(machine)
+        if bound is None:
+            bound = self.bound[machine] = [self.animations[name] for name in machine.states]
+
+        return bound
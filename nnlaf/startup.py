@@ -0,0 +1,170 @@
+"""This module contains the :class:`StartupTimeline` class, which records how long
+each phase of startup takes, and the functions that start pygame subsystems the
+first time they are needed instead of all at once in ``pygame.init()``."""
+
+import sys
+import threading
+import __builtin__
+import pygame
+
+from contextlib import contextmanager
+from timeit import default_timer
+
+
+class StartupTimeline:
+    """This class records the wall time of named startup phases, instants such as the
+    first frame, and optionally the time spent importing each module, so that
+    time-to-first-frame can be tracked. All times are in seconds from the moment the
+    timeline was created; :meth:`report` prints them in milliseconds.
+
+    Work that should not delay the first frame can be handed to :meth:`defer`; it is
+    run by :meth:`run_deferred`, which :func:`main.main` calls once the first frame
+    has been shown, as a phase named ``"deferred"``."""
+    def __init__(self):
+        self.origin = default_timer()
+
+        self.phases = []
+        self.marks = []
+        self.imports = []
+
+        self.deferred = []
+
+        self._import = None
+        self._import_stack = []
+
+    def now(self):
+        return default_timer() - self.origin
+
+    def add(self, name, start, end):
+        """Records a phase named ``name`` that ran from ``start`` to ``end``, both given
+        as ``default_timer()`` values. Used for work done on other threads."""
+        self.phases.append((name, start - self.origin, end - self.origin))
+
+    @contextmanager
+    def phase(self, name):
+        """Records the time spent in the ``with`` block as a phase named ``name``."""
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self.add(name, start, default_timer())
+
+    def mark(self, name):
+        """Records the current time as the instant ``name``."""
+        self.marks.append((name, self.now()))
+
+    def defer(self, function):
+        """Queues ``function`` to be called by :meth:`run_deferred`."""
+        self.deferred.append(function)
+
+    def run_deferred(self):
+        """Calls, in order, every function queued by :meth:`defer`."""
+        with self.phase("deferred"):
+            while self.deferred:
+                self.deferred.pop(0)()
+
+    def track_imports(self):
+        """Starts timing every import of a module that is not loaded yet. Each import
+        is charged only for its own time, not for the modules it imports in turn.
+        Only imports on the main thread are timed."""
+        if self._import is not None:
+            return
+
+        self._import = original = __builtin__.__import__
+        main_thread = threading.current_thread()
+
+        def timed_import(name, *args, **kwargs):
+            if name in sys.modules or threading.current_thread() is not main_thread:
+                return original(name, *args, **kwargs)
+
+            start = default_timer()
+            self._import_stack.append(0.0)
+            try:
+                return original(name, *args, **kwargs)
+            finally:
+                elapsed = default_timer() - start
+                nested = self._import_stack.pop()
+                if self._import_stack:
+                    self._import_stack[-1] += elapsed
+                self.imports.append((name, elapsed - nested))
+
+        __builtin__.__import__ = timed_import
+
+    def stop_tracking_imports(self):
+        """Restores the import function replaced by :meth:`track_imports`."""
+        if self._import is not None:
+            __builtin__.__import__ = self._import
+            self._import = None
+
+    def report(self, top_imports=10):
+        """Returns a multi-line string listing the phases and marks in the order they
+        started, followed by the ``top_imports`` slowest imports."""
+        events = [(start, "{:>9.1f} {:>9.1f}   {}".format(start * 1000.0, (end - start) * 1000.0, name))
+                  for name, start, end in self.phases]
+        events.extend((time, "{:>9.1f} {:>9}   * {}".format(time * 1000.0, "", name))
+                      for name, time in self.marks)
+        events.sort()
+
+        lines = ["start ms    wall ms   phase"]
+        lines.extend(line for time, line in events)
+
+        if self.imports:
+            total = sum(elapsed for name, elapsed in self.imports)
+            lines.append("")
+            lines.append("import ms   module ({} imports, {:.1f} ms total)".format(len(self.imports), total * 1000.0))
+            slowest = sorted(self.imports, key=lambda item: item[1], reverse=True)[:top_imports]
+            for name, elapsed in slowest:
+                lines.append("{:>9.1f}   {}".format(elapsed * 1000.0, name))
+
+        return "\n".join(lines)
+
+
+timeline = StartupTimeline()
+
+
+def init_display(size):
+    """Starts only the pygame subsystems needed to show a window of ``size``: video,
+    which also delivers events, and the timer behind ``pygame.time.get_ticks()``.
+    ``pygame.time`` has no public init function; its private init hook is called if
+    this pygame has one. If ``get_ticks()`` still does not advance, which would stall
+    the game loop, everything is started with ``pygame.init()`` instead, and
+    ``RuntimeError`` is raised if even that does not start the timer."""
+    with timeline.phase("display"):
+        pygame.display.init()
+
+        init_timer = getattr(pygame.time, "__PYGAMEinit__", None)
+        if init_timer is not None:
+            init_timer()
+
+        if not timer_running():
+            print "STARTUP: The timer did not start with the display; calling pygame.init()"
+            pygame.init()
+            if not timer_running():
+                raise RuntimeError("pygame.time.get_ticks() does not advance")
+
+        return pygame.display.set_mode(size)
+
+
+def timer_running():
+    """Returns ``True`` if ``pygame.time.get_ticks()`` advances across a 1 ms wait."""
+    start = pygame.time.get_ticks()
+    pygame.time.wait(1)
+    return pygame.time.get_ticks() != start
+
+
+def ensure_mixer(frequency=44100, size=-16, channels=2, buffer=1024):
+    """Starts the mixer if it is not running yet. Call this before any use of
+    ``pygame.mixer``; it costs nothing once the mixer is running."""
+    if not pygame.mixer.get_init():
+        with timeline.phase("mixer"):
+            pygame.mixer.init(frequency, size, channels, buffer)
+
+
+def ensure_joystick():
+    """Starts the joystick subsystem and the first joystick, if there is one, unless
+    that has already been done."""
+    if not pygame.joystick.get_init():
+        with timeline.phase("joystick"):
+            pygame.joystick.init()
+            if pygame.joystick.get_count() > 0:
+                pygame.joystick.Joystick(0).init()
@@ -0,0 +1,211 @@
+"""This module contains the on-disk string table used for game text, and the
+:class:`StringStore` that serves strings to the :class:`ScriptAPI <script_api.ScriptAPI>`.
+
+Each locale has its own table file, named ``strings_<locale>.table`` in the data
+directory. A table holds a sorted index of string names followed by the string
+values, grouped into pages. Only the index is read when a table is opened; a page
+of values is read the first time one of its strings is needed, and the least
+recently used pages are dropped once more than ``max_pages`` are resident."""
+
+import mmap
+import struct
+
+from collections import OrderedDict
+
+TABLE_MAGIC = "NNST"
+TABLE_VERSION = 1
+
+HEADER = struct.Struct("<4sHHII")
+NAME = struct.Struct("<I")
+PAGE = struct.Struct("<II")
+LENGTH = struct.Struct("<I")
+
+
+class StringTableError(Exception):
+    pass
+
+
+def table_name(locale):
+    """Returns the file name of the string table for ``locale``."""
+    return "strings_{}.table".format(locale)
+
+
+def _encode(s):
+    if isinstance(s, unicode):
+        return s.encode("utf-8")
+    return s
+
+
+def write_string_table(path, strings, page_size=64):
+    """Writes the ``dict`` ``strings``, mapping names to values, to a string table at
+    ``path``. Strings are sorted by name and stored ``page_size`` to a page."""
+    names = sorted(strings)
+
+    name_blob = []
+    name_table = []
+    offset = 0
+    for name in names:
+        data = _encode(name)
+        name_table.append(NAME.pack(offset))
+        name_blob.append(LENGTH.pack(len(data)) + data)
+        offset += LENGTH.size + len(data)
+    name_blob = "".join(name_blob)
+
+    pages = []
+    for start in xrange(0, len(names), page_size):
+        page = []
+        for name in names[start:start + page_size]:
+            data = _encode(strings[name])
+            page.append(LENGTH.pack(len(data)) + data)
+        pages.append("".join(page))
+
+    page_count = len(pages)
+    data_at = HEADER.size + NAME.size * len(names) + len(name_blob) + PAGE.size * page_count
+
+    page_table = []
+    for page in pages:
+        page_table.append(PAGE.pack(data_at, len(page)))
+        data_at += len(page)
+
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(TABLE_MAGIC, TABLE_VERSION, page_size, len(names), page_count))
+        f.write("".join(name_table))
+        f.write(name_blob)
+        f.write("".join(page_table))
+        f.write("".join(pages))
+
+
+class StringTable:
+    """This class gives read access to a string table written by :func:`write_string_table`.
+    Values are read a page at a time, interned, and kept until their page is evicted.
+    If ``data`` is given, such as a buffer from a :class:`PackFile <pack.PackFile>`, it
+    is read instead of the file at ``path``."""
+    def __init__(self, path, max_pages=8, data=None):
+        self.path = path
+        self.max_pages = max_pages
+
+        self.owns_data = data is None
+        if data is None:
+            with open(path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.data = data
+
+        if len(self.data) < HEADER.size:
+            raise StringTableError("String table {} is truncated".format(path))
+
+        magic, version, self.page_size, count, self.page_count = HEADER.unpack_from(self.data)
+        if magic != TABLE_MAGIC or version != TABLE_VERSION:
+            raise StringTableError("String table {} has an unsupported format".format(path))
+
+        names_at = HEADER.size + NAME.size * count
+        names_end = names_at
+        self.index = {}
+        for n in xrange(count):
+            offset, = NAME.unpack_from(self.data, HEADER.size + NAME.size * n)
+            length, = LENGTH.unpack_from(self.data, names_at + offset)
+            start = names_at + offset + LENGTH.size
+            names_end = start + length
+            self.index[self.data[start:names_end]] = n
+
+        self.pages_at = names_end
+
+        self.pages = OrderedDict()
+        self.page_loads = 0
+
+    def close(self):
+        self.pages.clear()
+        if self.owns_data:
+            self.data.close()
+
+    def __contains__(self, name):
+        return _encode(name) in self.index
+
+    def get(self, name):
+        """Returns the value stored under ``name``, or ``None`` if there is none."""
+        n = self.index.get(_encode(name))
+        if n is None:
+            return None
+
+        page_n, entry = divmod(n, self.page_size)
+
+        page = self.pages.pop(page_n, None)
+        if page is None:
+            page = self._load_page(page_n)
+            while len(self.pages) >= self.max_pages:
+                self.pages.popitem(last=False)
+        self.pages[page_n] = page
+
+        return page[entry]
+
+    def _load_page(self, page_n):
+        offset, size = PAGE.unpack_from(self.data, self.pages_at + PAGE.size * page_n)
+
+        page = []
+        pos = offset
+        stop = offset + size
+        while pos < stop:
+            length, = LENGTH.unpack_from(self.data, pos)
+            pos += LENGTH.size
+            page.append(intern(self.data[pos:pos + length]))
+            pos += length
+
+        self.page_loads += 1
+        return page
+
+
+class StringStore:
+    """This class looks up strings by name. The string table of the current locale takes
+    precedence; strings added at run time (by scripts, with :meth:`add`) are the fallback
+    for names it does not have, in every locale. That way a script's own text is shown
+    until a translation for it exists. The locale can be changed at any time with
+    :meth:`set_locale`; the next lookups read from the new locale's table, and nothing
+    else needs to be reloaded.
+
+    If ``pack`` is set to a :class:`PackFile <pack.PackFile>`, tables are read from it
+    rather than from ``file_map``."""
+    def __init__(self, file_map, locale="en", max_pages=8):
+        self.file_map = file_map
+        self.max_pages = max_pages
+        self.pack = None
+
+        self.added = {}
+
+        self.locale = None
+        self.table = None
+        self.set_locale(locale)
+
+    def set_locale(self, locale):
+        """Switches to the string table for ``locale``. If there is no table for it, only
+        strings added at run time are available."""
+        if self.table is not None:
+            self.table.close()
+            self.table = None
+
+        self.locale = locale
+
+        name = table_name(locale)
+        if self.pack is not None:
+            if name in self.pack:
+                self.table = StringTable(name, self.max_pages, self.pack.buffer(name))
+            return
+
+        path = self.file_map.get(name)
+        if path is not None:
+            self.table = StringTable(path, self.max_pages)
+
+    def add(self, name, string):
+        """Adds ``string`` under ``name``; it is kept in memory and used in every locale whose
+        table has no string of that name."""
+        self.added[name] = string
+
+    def get(self, name, default=None):
+        """Returns the string stored under ``name`` in the current locale's table, or else the
+        one added under ``name``, or ``default`` if there is neither."""
+        string = None
+        if self.table is not None:
+            string = self.table.get(name)
+        if string is None:
+            string = self.added.get(name)
+        if string is None:
+            return default
+        return string
@@ -0,0 +1,87 @@
+"""This module contains the :class:`SurfaceCache` class, a byte-budgeted LRU cache
+for surfaces that are expensive to make but cheap to keep."""
+
+from collections import OrderedDict
+
+
+class SurfaceCache:
+    """This class is a least-recently-used cache of surfaces with a budget measured
+    in bytes of pixel data. When adding a surface would exceed ``max_bytes``, the
+    least recently used surfaces are evicted until it fits.
+
+    Hit and miss counts are kept so the effectiveness of the cache can be
+    checked; see :attr:`hit_rate`."""
+    def __init__(self, max_bytes=4 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def surface_bytes(surface):
+        """Returns the number of bytes of pixel data held by ``surface``."""
+        return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+    @property
+    def hit_rate(self):
+        """The fraction of lookups that were hits, from ``0.0`` to ``1.0``."""
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return float(self.hits) / total
+
+    def get(self, key):
+        """Returns the surface stored under ``key`` and marks it as most recently
+        used, or returns ``None`` if there is no such surface."""
+        surface = self._entries.pop(key, None)
+        if surface is None:
+            self.misses += 1
+            return None
+
+        self._entries[key] = surface
+        self.hits += 1
+        return surface
+
+    def put(self, key, surface):
+        """Stores ``surface`` under ``key``, evicting older surfaces as needed to
+        stay within ``max_bytes``. Surfaces larger than the entire budget are
+        not stored at all."""
+        size = self.surface_bytes(surface)
+        if size > self.max_bytes:
+            return
+
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.bytes -= self.surface_bytes(old)
+
+        while self._entries and self.bytes + size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= self.surface_bytes(evicted)
+            self.evictions += 1
+
+        self._entries[key] = surface
+        self.bytes += size
+
+    def clear(self):
+        """Removes all surfaces from the cache; statistics are kept."""
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        """Returns a ``dict`` summarizing the current state of the cache."""
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hit_rate,
+        }
@@ -0,0 +1,171 @@
+"""This module contains :func:`display_format`, which converts loaded images to
+the pixel format that blits fastest onto the display, :func:`alpha_format` and
+:func:`blank_like`, which give surfaces generated at run time a fixed format
+without reading their pixels, and the :class:`BlitAudit` class, which reports
+the formats of the surfaces actually blitted each frame.
+
+A blit between surfaces of different pixel formats converts every pixel on the
+fly, and a blit with per-pixel alpha blends every pixel; both are several times
+slower than copying. Images whose alpha is only ever fully opaque or fully
+transparent, which is most pixel art, lose nothing by using a colorkey instead,
+and with RLE acceleration the transparent runs are skipped entirely."""
+
+import pygame
+
+KEY_COLORS = ((255, 0, 255), (0, 255, 255), (1, 2, 3), (254, 1, 253))
+
+
+def classify(surface):
+    """Returns ``(kind, key)`` for ``surface``, from a single read of its pixels. ``kind`` is
+    ``"none"`` if ``surface`` has no per-pixel alpha, ``"opaque"`` if every pixel is fully
+    opaque, ``"binary"`` if every pixel is fully opaque or fully transparent, and
+    ``"blended"`` otherwise. For ``"binary"`` surfaces ``key`` is a color from ``KEY_COLORS``
+    that no opaque pixel has, or ``None`` if they are all used; otherwise it is ``None``."""
+    if not surface.get_flags() & pygame.SRCALPHA:
+        return "none", None
+
+    pixels = pygame.image.tostring(surface, "RGBA")
+    alpha = pixels[3::4]
+    if not alpha.translate(None, "\xff"):
+        return "opaque", None
+    if alpha.translate(None, "\x00\xff"):
+        return "blended", None
+
+    for color in KEY_COLORS:
+        needle = "".join(chr(c) for c in color) + "\xff"
+        pos = pixels.find(needle)
+        while pos != -1 and pos % 4 != 0:
+            pos = pixels.find(needle, pos + 1)
+        if pos == -1:
+            return "binary", color
+
+    return "binary", None
+
+
+def display_format(surface):
+    """Returns ``surface`` in the format that blits fastest onto the display, or
+    ``surface`` itself if no display is open:
+
+    *   Surfaces without per-pixel alpha, or whose pixels are all opaque, are
+        converted to the display format.
+    *   Surfaces whose alpha is only 0 or 255 are converted to the display format with
+        a colorkey for the transparent pixels and ``RLEACCEL``.
+    *   Surfaces with partial transparency are converted with ``convert_alpha()``.
+
+    This reads every pixel of a surface with per-pixel alpha, so it is meant for images
+    as they are loaded, once each. Surfaces generated while the game runs should be made
+    with :func:`blank_like` or converted with :func:`alpha_format` instead."""
+    if pygame.display.get_surface() is None:
+        return surface
+
+    kind, key = classify(surface)
+    if kind == "none" or kind == "opaque":
+        return surface.convert()
+
+    if key is not None:
+        converted = pygame.Surface(surface.get_size()).convert()
+        converted.fill(key)
+        converted.blit(surface, (0, 0))
+        converted.set_colorkey(key, pygame.RLEACCEL)
+        return converted
+
+    return surface.convert_alpha()
+
+
+def alpha_format(surface):
+    """Returns ``surface`` converted with ``convert_alpha()`` without reading its pixels, or
+    ``surface`` itself if no display is open. This is the fixed format for surfaces
+    generated at run time, such as sprite effects."""
+    if pygame.display.get_surface() is None:
+        return surface
+
+    return surface.convert_alpha()
+
+
+def blank_like(source, size):
+    """Returns a new, fully transparent surface of ``size`` to draw parts of ``source`` on,
+    already in the format :func:`display_format` chose for ``source``: the display format
+    with the same colorkey if ``source`` has one, or else per-pixel alpha. What is drawn
+    from ``source`` keeps that format, so the result needs no conversion."""
+    key = source.get_colorkey()
+    if key is not None and pygame.display.get_surface() is not None:
+        surface = pygame.Surface(size).convert()
+        surface.fill(key)
+        surface.set_colorkey(key, pygame.RLEACCEL)
+        return surface
+
+    surface = alpha_format(pygame.Surface(size, pygame.SRCALPHA))
+    surface.fill((0, 0, 0, 0))
+    return surface
+
+
+def describe(surface):
+    """Returns a short description of the pixel format of ``surface``, noting when it
+    differs from the display's."""
+    flags = surface.get_flags()
+
+    parts = ["{}bpp".format(surface.get_bitsize())]
+    if flags & pygame.SRCALPHA:
+        parts.append("per-pixel alpha")
+    if surface.get_colorkey() is not None:
+        parts.append("colorkey")
+    if flags & pygame.RLEACCEL:
+        parts.append("RLE")
+
+    display = pygame.display.get_surface()
+    if display is not None:
+        masks = surface.get_masks()
+        display_masks = display.get_masks()
+        if flags & pygame.SRCALPHA:
+            matches = masks[:3] == display_masks[:3]
+        else:
+            matches = masks == display_masks and surface.get_bitsize() == display.get_bitsize()
+        if not matches:
+            parts.append("NOT DISPLAY FORMAT")
+
+    return " ".join(parts)
+
+
+class BlitAudit:
+    """This class stands in for the screen surface and counts the formats of the
+    surfaces blitted onto it; every other attribute is passed through to the real
+    surface. Call :meth:`end_frame` after each frame is drawn: the formats blitted
+    that frame are printed whenever they differ from the previous frame's, and the
+    totals are kept for :meth:`report`."""
+    def __init__(self, surface):
+        self.surface = surface
+
+        self.frame = {}
+        self.last_frame = None
+        self.totals = {}
+        self.frames = 0
+
+    def __getattr__(self, name):
+        return getattr(self.surface, name)
+
+    def blit(self, source, dest, area=None, special_flags=0):
+        description = describe(source)
+        self.frame[description] = self.frame.get(description, 0) + 1
+        return self.surface.blit(source, dest, area, special_flags)
+
+    def end_frame(self):
+        self.frames += 1
+
+        for description, count in self.frame.iteritems():
+            self.totals[description] = self.totals.get(description, 0) + count
+
+        if self.frame != self.last_frame:
+            print "AUDIT: frame {}: {}".format(self.frames, ", ".join(
+                "{} x {}".format(count, description) for description, count in sorted(self.frame.items())
+            ) or "no blits")
+
+        self.last_frame = self.frame
+        self.frame = {}
+
+    def report(self):
+        """Returns a multi-line string with the number of blits of each format per frame."""
+        lines = ["blits/frame   format"]
+        for description, count in sorted(self.totals.items(), key=lambda item: item[1], reverse=True):
+            lines.append("{:>11.1f}   {}".format(float(count) / max(self.frames, 1), description))
+
+        return "\n".join(lines)
@@ -1,28 +1,166 @@
 from rect import Rect
 
+KINDS = ("battles", "targets", "terrain")
+
+
+def tracked(name):
+    """Returns a property that keeps its value in ``_<name>`` and, when set on an object
+    that belongs to a :class:`WorldRegistry`, marks the object as changed."""
+    attr = "_" + name
+
+    def get(self):
+        return getattr(self, attr)
+
+    def set(self, value):
+        setattr(self, attr, value)
+        if self.registry is not None:
+            self.registry.changed(self)
+
+    return property(get, set)
+
+
+class WorldRegistry:
+    """This class holds every world object in the game, indexed both by id and by zone.
+    Objects added to the registry report changes to their ``zone`` attribute, so the
+    zone index is always current; finding the contents of a zone is a dictionary
+    lookup rather than a search of the whole world.
+
+    ``by_id`` maps each kind (``"battles"``, ``"targets"`` or ``"terrain"``) to a
+    ``dict`` of objects by id. ``by_zone`` maps each zone to a ``dict`` of lists of
+    objects by kind, in the order the objects entered the zone.
+
+    The registry also records which objects were added, moved or removed since
+    :meth:`take_changes` was last called, so a save only has to look at those."""
+    def __init__(self):
+        self.by_id = dict((kind, {}) for kind in KINDS)
+        self.by_zone = {}
+
+        self.dirty = {}
+        self.removed = {}
+
+    def add(self, obj_id, obj):
+        """Adds ``obj`` under ``obj_id``, replacing any object of the same kind and id."""
+        old = self.by_id[obj.kind].get(obj_id)
+        if old is not None:
+            self.remove(old)
+
+        self.by_id[obj.kind][obj_id] = obj
+        obj.obj_id = obj_id
+        obj.registry = self
+
+        if obj.zone is not None:
+            self._zone_list(obj.zone, obj.kind).append(obj)
+
+        key = (obj.kind, obj_id)
+        self.removed.pop(key, None)
+        self.dirty[key] = obj
+
+        return obj
+
+    def remove(self, obj):
+        """Removes ``obj`` from the registry."""
+        del self.by_id[obj.kind][obj.obj_id]
+        if obj.zone is not None:
+            self._zone_list(obj.zone, obj.kind).remove(obj)
+        obj.registry = None
+
+        key = (obj.kind, obj.obj_id)
+        self.dirty.pop(key, None)
+        self.removed[key] = obj.home_zone
+
+    def changed(self, obj):
+        """Called by an object when its position changes."""
+        self.dirty[(obj.kind, obj.obj_id)] = obj
+
+    def take_changes(self):
+        """Returns ``(dirty, removed)`` and starts recording afresh. ``dirty`` maps
+        ``(kind, id)`` to each object added or changed since the last call; ``removed`` maps
+        ``(kind, id)`` to the home zone of each object removed since then."""
+        dirty, removed = self.dirty, self.removed
+        self.dirty = {}
+        self.removed = {}
+        return dirty, removed
+
+    def get(self, kind, obj_id):
+        """Returns the ``kind`` object with id ``obj_id``, or ``None``."""
+        return self.by_id[kind].get(obj_id)
+
+    def in_zone(self, zone, kind):
+        """Returns the list of ``kind`` objects in ``zone``. The list belongs to the registry
+        and changes as objects move; copy it if that matters."""
+        entry = self.by_zone.get(zone)
+        if entry is None:
+            return []
+        return entry[kind]
+
+    def moved(self, obj, old_zone, new_zone):
+        """Called by an object when its ``zone`` changes from ``old_zone`` to ``new_zone``."""
+        if old_zone is not None:
+            self._zone_list(old_zone, obj.kind).remove(obj)
+        if new_zone is not None:
+            self._zone_list(new_zone, obj.kind).append(obj)
+        self.dirty[(obj.kind, obj.obj_id)] = obj
+
+    def _zone_list(self, zone, kind):
+        entry = self.by_zone.get(zone)
+        if entry is None:
+            entry = self.by_zone[zone] = dict((k, []) for k in KINDS)
+        return entry[kind]
+
+
+class WorldObject(Rect):
+    """This is the base class of all objects kept in a :class:`WorldRegistry`. Setting
+    ``zone`` on an object that belongs to a registry updates the registry's zone index,
+    and setting ``zone``, ``x``, ``y``, ``w`` or ``h`` marks the object as changed.
+    ``home_zone`` is the first zone the object was given, which for objects from a
+    level file is the zone that has to be loaded to build it."""
+    kind = None
 
-class Battle(Rect):
-    """This class represents a single 'battle' event during the game."""
     def __init__(self):
+        self.obj_id = None
+        self.registry = None
+        self.home_zone = None
+        self._zone = None
         Rect.__init__(self)
-        self.zone = None
+
+    @property
+    def zone(self):
+        """The name of the zone this object belongs to, or ``None``."""
+        return self._zone
+
+    @zone.setter
+    def zone(self, zone):
+        old_zone = self._zone
+        self._zone = zone
+        if self.home_zone is None:
+            self.home_zone = zone
+        if self.registry is not None and zone != old_zone:
+            self.registry.moved(self, old_zone, zone)
+
+    x = tracked("x")
+    y = tracked("y")
+    w = tracked("w")
+    h = tracked("h")
+
+
+class Battle(WorldObject):
+    """This class represents a single 'battle' event during the game."""
+    kind = "battles"
 
     def draw(self, surface):
         pass
 
 
-class Target(Rect):
+class Target(WorldObject):
     """This class represents a single 'target' in the game world, which is any
     non-terrain and non-enemy object that the player can interact with."""
-    def __init__(self):
-        Rect.__init__(self)
-        self.zone = None
+    kind = "targets"
 
     def draw(self, surface):
         pass
 
 
-class Terrain(Rect):
+class Terrain(WorldObject):
     """This class represents an arbitrary amount of 'terrain', which is all of the
     non-interactive parts of the world. Most importantly, terrain provides layout
     and collision data.
@@ -33,16 +171,25 @@ class Terrain(Rect):
 
     Future engine features and optimizations might dictate the optimal 'size' of each
     ``Terrain`` instance, but for now it's a design convenience so that world data can
-    be organized in arbitrary ways."""
+    be organized in arbitrary ways.
+
+    Setting ``static`` or ``images``, or calling :meth:`add_image`, marks the terrain as
+    changed; modify ``images`` in place only through :meth:`add_image`."""
+    kind = "terrain"
+
+    static = tracked("static")
+    images = tracked("images")
+
     def __init__(self):
-        Rect.__init__(self)
-        self.zone = None
+        WorldObject.__init__(self)
         self.static = True
         self.images = []
 
     def add_image(self, image_surface):
         self.union(Rect(*image_surface.get_rect()))
         self.images.append(image_surface)
+        if self.registry is not None:
+            self.registry.changed(self)
 
     @property
     def rect(self):